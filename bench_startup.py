@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+#
+# Cold start benchmark of pliterki.
+#
+# Program is run several times, each time in a new process with
+# an empty cache directory, on a file which needs no lookups.
+# Neither aspell nor caches nor terminal should be touched then,
+# so the time is spent only on starting the interpreter and
+# the program. Median time is compared with the budget; exit
+# status 1 means that budget has been exceeded.
+#
+# Usage: bench_startup.py [-n RUNS] [--budget MS] [--python PATH]
+
+import sys, os, time, tempfile, shutil
+
+# default budget of median cold start time [ms]
+BUDGET	= 150.0
+RUNS	= 11
+
+def measure(command, env, cwd, runs):
+	"""Returns sorted list of run times [ms] of command"""
+	import subprocess
+	times = []
+	for i in xrange(runs):
+		start = time.time()
+		status = subprocess.call(command, env=env, cwd=cwd)
+		times.append((time.time() - start) * 1000.0)
+		if status != 0:
+			sys.stderr.write("'%s' exited with status %d\n" % (' '.join(command), status))
+			sys.exit(2)
+
+	times.sort()
+	return times
+
+def main():
+	runs	= RUNS
+	budget	= BUDGET
+	python	= sys.executable
+
+	args = sys.argv[1:]
+	while args:
+		if args[0] == '-n':
+			runs = int(args[1])
+		elif args[0] == '--budget':
+			budget = float(args[1])
+		elif args[0] == '--python':
+			python = args[1]
+		else:
+			print 'Usage: bench_startup.py [-n RUNS] [--budget MS] [--python PATH]'
+			sys.exit(1)
+		args = args[2:]
+
+	program	= os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pliterki.py')
+	home	= tempfile.mkdtemp()
+	try:
+		env = dict(os.environ, HOME=home + os.sep)
+
+		# text without any word to check
+		file = open(os.path.join(home, 'text.txt'), 'w')
+		file.write('1984, 2001 -- 42!\n' * 100)
+		file.close()
+
+		tests = [
+			('python',  [python, '-c', 'pass']),
+			('import',  [python, '-c', 'import sys; sys.path.insert(0, %r); import pliterki' % os.path.dirname(program)]),
+			('run',     [python, program, '-n', '-q', 'text.txt']),
+		]
+
+		results = {}
+		for name, command in tests:
+			times = measure(command, env, home, runs)
+			results[name] = times[len(times)/2]
+			print '%-8s median %7.1f ms   min %7.1f ms   max %7.1f ms' % (name, results[name], times[0], times[-1])
+	finally:
+		shutil.rmtree(home)
+
+	if results['run'] > budget:
+		print 'FAIL: cold start %0.1f ms exceeds budget of %0.1f ms' % (results['run'], budget)
+		sys.exit(1)
+	else:
+		print 'ok: cold start %0.1f ms, budget %0.1f ms' % (results['run'], budget)
+
+if __name__ == '__main__':
+	main()
@@ -7,7 +7,7 @@
 #
 # $Id: pliterki.py,v 1.2 2006-09-27 18:55:34 wojtek Exp $
 
-import sys, struct
+import sys, os, re, types, struct, array, sets
 
 class SimpleTerm:
 	"""SimpleTerm watch terminal's size. Has also some useful methods"""
@@ -39,7 +39,6 @@ class SimpleTerm:
 
 			try:
 				# are env variables set?
-				import os
 				os.environ['LINES']
 				os.environ['COLUMNS']
 				self.has_env = True
@@ -98,14 +97,40 @@ class SimpleTerm:
 	def settitle(self, title):
 		"""set xterm title"""
 		try:
-			import os
 			if os.environ['TERM'] == 'xterm':
 				self.fd.write(self.ESC + ']2;' + title + self.BEL)
 				self.fd.flush()
 		except:
 			pass
 
-Terminal = SimpleTerm()
+class Lazy:
+	"""
+	Proxy of object which is created by factory(*args) on first
+	use of any of its attributes. Methods of the object are then
+	kept in the proxy, so later calls cost nothing extra.
+	"""
+	def __init__(self, factory, *args):
+		self.__factory	= factory
+		self.__args		= args
+		self.__object	= None
+
+	def load(self):
+		"""Creates object now (if not created yet) and returns it"""
+		if self.__object == None:
+			self.__object = self.__factory(*self.__args)
+		return self.__object
+
+	def __getattr__(self, name):
+		if name.startswith('_'):
+			raise AttributeError(name)	# don't create object for copy, pickle etc.
+
+		value = getattr(self.load(), name)
+		if callable(value):
+			setattr(self, name, value)
+		return value
+
+# terminal is queried (ioctl, SIGWINCH handler) only in interactive mode
+Terminal = Lazy(SimpleTerm)
 
 class Filter:
 	"""
@@ -124,27 +149,80 @@ class Filter:
 		"""Process line"""
 		raise RuntimeError('Abstract method called')
 
+	def process(self, lines):
+		"""
+		Generator: processes whole document given as sequence
+		of lines (without line separators), yields pairs
+		(line, ranges).
+		"""
+		self.reset()
+		for line in lines:
+			yield (line, self.process_line(line))
+
+def whole_line(text):
+	"Returns ranges making whole line dead"
+	if text:
+		return [(0, len(text))]
+	else:
+		return []
+
+def glue_ranges(ranges):
+	"Returns list of ranges where adjacent ranges are glued"
+	if len(ranges) < 2:
+		return ranges
+
+	result = []
+	start, end = ranges[0]
+	for s, e in ranges[1:]:
+		if end != s:
+			result.append( (start, end) )
+			start = s
+		end = e
+	result.append( (start, end) )
+	return result
+
 class HTMLFilter(Filter):
 	"""
 	HTMLFilter leaves regular text and 
 	contents of title and alt attributes
 	"""
-	def reset(self):
-		self.state		= 'text'	# initial state
 
-		import re
-		self.re_split	= re.compile(r"\s+|<!--|-->|<\?|\?>|<|>|\"|title|TITLE|alt|ALT|=")
-		self.re_ws		= re.compile(r"\s+")
+	# automat states
+	TEXT, COMMENT, SSI, TAG, TITLE_ALT, EQ, STRING = range(7)
+
+	scanners = None		# compiled once, see reset
+
+	def reset(self):
+		self.state		= self.TEXT	# initial state
+
+		if HTMLFilter.scanners == None:
+			tokens = {
+				'all'     : r'<!--|-->|<\?|\?>|<|>|"|title|TITLE|alt|ALT|=',
+				'text'    : r'<!--|<\?|<',
+				'comment' : r'<!--|-->',
+				'ssi'     : r'<\?|\?>',
+				'tag'     : r'<!--|-->|<\?|\?>|>|title|TITLE|alt|ALT',
+				'string'  : r'<!--|-->|<\?|\?>|>|"',
+			}
+			for key in tokens:
+				tokens[key] = re.compile(tokens[key])
+
+			# state => scanner
+			HTMLFilter.scanners = [
+				tokens['text'], tokens['comment'], tokens['ssi'], tokens['tag'],
+				tokens['all'], tokens['all'], tokens['string']
+			]
+			HTMLFilter.re_blank = re.compile(r"\s*$")
 
 # process_line realizes a Mealy's automat. It's states are:
 #
-# * text (regular text we want to check)
-# * comment
-# * php
-# * tag (HTMLtag)
-# * title/alt (title and alt attributes inside tag)
-# * = (character)
-# * string (string enclosed in "")
+# * TEXT (regular text we want to check)
+# * COMMENT
+# * SSI (server-side includes, <? ... ?>)
+# * TAG (HTMLtag)
+# * TITLE_ALT (title and alt attributes inside tag)
+# * EQ (= character)
+# * STRING (string enclosed in "")
 #
 # Input signals (tokens) are:
 # * <!--		- start of comment
@@ -164,204 +242,554 @@ class HTMLFilter(Filter):
 # 1. open range
 # 2. close range
 # 3. remove last opened, not closed range
+#
+# Tokens are never split by a line, so each state has its
+# own scanner, which finds only tokens meaningful in that state
+# (and tokens that could overlap them). Text between tokens
+# matters only in states TITLE_ALT and EQ -- there all text
+# except whitespaces is "other".
 
-	def tokenize(self, line, regexp):
-		"""
-		Works like re.split, but also leaves nonmatched substrings.
-		"""
-		result = []
-		ps = 0
-		pe = 0
-		for match in regexp.finditer(line):
-			s = match.start()
-			e = match.end()
-
-			if s > pe: result.append(line[pe:s])
+	def process_line(self, text):
+		TEXT, COMMENT, SSI, TAG, TITLE_ALT, EQ, STRING = range(7)
+		scanners	= self.scanners
+		state		= self.state
+		ranges		= []	# list of closed ranges
+		start		= None	# start of opened range
+
+		if state != TEXT and state != STRING:
+			# comment, ssi or tag has started in previous line
+			start = 0
 
-			result.append(line[s:e])
-			ps, pe = s, e
-		
-		if pe < len(line):
-			result.append(line[pe:])
+		pos = 0
+		while True:
+			match = scanners[state].search(text, pos)
+			if match:
+				s, e  = match.span()
+				input = match.group()
+			else:
+				s = e = len(text)
+				input = None
 
-		return result
+			if (state == TITLE_ALT or state == EQ) and not self.re_blank.match(text, pos, s):
+				# other token
+				state = TAG
 
-	def process_line(self, text):
-	
-		class Ranges:
-			"""List of ranges"""
-			def __init__(self):
-				self.__list		= []
-				self.__finished	= True
-
-			def start(self, s):
-				"start new range"
-				if not self.__finished:
-					raise RuntimeError("Range %d not finished" % len(self.__list))
-				self.__list.append( (s, None) )
-				self.__finished	= False
-
-			def end(self, e):
-				"finish opened range"
-				s, _ = self.__list[-1]
-				self.__list[-1] = (s,e)
-				self.__finished	= True
-			
-			def cancel(self):
-				"nullify opened range"
-				del self.__list[-1]
-				self.__finished	= True
-
-			def isfinished(self):
-				"return true if there is an not closed range"
-				return self.__finished
-
-			def list(self):
-				"return list of ranges; adjecent ranges are glued"
-				if self.__finished:
-					if len(self.__list) < 2: 
-						return self.__list
-					else:
-						tmp = []
-						start,end = self.__list[0]
-						for s,e in self.__list[1:]:
-							if end != s:
-								tmp.append( (start, end) )
-								start, end =  s, e
-							else:
-								end = e
+			if input == None:
+				break
 
-						return tmp + [(start, end)]
-				else:
-					raise RuntimeError('List unfinished!')
-	
-		pos = 0
-		ranges = Ranges()
-		if self.state in ['comment', 'php', 'tag']:
-			# comment, php or tag has started in previous line
-			ranges.start(pos)
-
-		tokens = self.tokenize(text, self.re_split)
-		for input in tokens:
-			if self.state == 'text':
+			if state == TEXT:
+				# only '<', '<!--' and '<?' are found
+				start = s
 				if input == '<!--':
-					ranges.start(pos)
-					self.state = 'comment'
+					state = COMMENT
 				elif input == '<?':
-					ranges.start(pos)
-					self.state = 'ssi'
-				elif input == '<':
-					ranges.start(pos)
-					self.state = 'tag'
-
-			elif self.state == 'ssi':
-				if input == '?>':
-					ranges.end(pos + len(input))
-					self.state = 'text'
-
-			elif self.state == 'comment':
-				if input == '-->':
-					ranges.end(pos + len(input))
-					self.state = 'text'
-
-			elif self.state == 'tag':
+					state = SSI
+				else:
+					state = TAG
+
+			elif state == COMMENT or state == SSI:
+				if input == '-->' or input == '?>':
+					ranges.append( (start, e) )
+					start = None
+					state = TEXT
+
+			elif state == TAG:
 				if input == '>':
-					ranges.end(pos + len(input))
-					self.state = 'text'
-				elif input in ['title','TITLE','alt','ALT']:
-					self.state = 'title/alt'
+					ranges.append( (start, e) )
+					start = None
+					state = TEXT
+				elif input in ('title', 'TITLE', 'alt', 'ALT'):
+					state = TITLE_ALT
 
-			elif self.state == 'title/alt':
+			elif state == TITLE_ALT:
 				if input == '>':
-					ranges.end(pos + len(input))
-					self.state = 'text'
-				elif self.re_ws.match(input):
-					pass
+					ranges.append( (start, e) )
+					start = None
+					state = TEXT
 				elif input == '=':
-					self.state = '='
+					state = EQ
 				else:
-					self.state = 'tag'
+					state = TAG
 
-			elif self.state == '=':
-				if self.re_ws.match(input):
-					pass
-				elif input == '"':
-					ranges.end(pos + len(input))
-					self.state = 'string'
+			elif state == EQ:
+				if input == '"':
+					ranges.append( (start, e) )
+					start = None
+					state = STRING
 				elif input == '>':
-					ranges.end(pos + len(input))
-					self.state = 'text'
+					ranges.append( (start, e) )
+					start = None
+					state = TEXT
 				else:
-					self.state = 'tag'
+					state = TAG
 
-			elif self.state == 'string':
+			elif state == STRING:
 				if input == '>':
-					ranges.cancel()
-					self.state = 'text'
+					# unterminated string: drop the range of its tag
+					if ranges:
+						del ranges[-1]
+					state = TEXT
 				elif input == '"':
-					ranges.start(pos)
-					self.state = 'tag'
+					start = s
+					state = TAG
 
 			else:
-				raise RuntimeError('Automat error, unknown state %s' % self.state)
+				raise RuntimeError('Automat error, unknown state %s' % state)
 
-			pos = pos + len(input)
+			pos = e
 		
-		if not ranges.isfinished():
-			ranges.end(pos)
-		return ranges.list()
+		if start != None and start < len(text):
+			ranges.append( (start, len(text)) )
+		self.state = state
+
+		return glue_ranges(ranges)
+
+class MarkdownFilter(Filter):
+	"""
+	MarkdownFilter leaves regular text; code blocks (fenced
+	and indented), inline code, link targets, URLs and HTML
+	tags are dead.
+	"""
+
+	re_fence = None		# compiled once, see reset
+
+	def reset(self):
+		self.fence	= None	# (character, length) of opened fence
+		self.blank	= True	# previous line is blank
+		self.code	= False	# inside indented code block
+
+		if MarkdownFilter.re_fence == None:
+			MarkdownFilter.re_fence		= re.compile(r" {0,3}(`{3,}|~{3,})")
+			MarkdownFilter.re_code		= re.compile(r"(    |\t)")
+			MarkdownFilter.re_link		= re.compile(r" {0,3}\[[^\]]+\]:")
+			MarkdownFilter.re_inline	= re.compile(r"`+|\]\([^)]*\)|</?[A-Za-z!][^>]*>|(?:https?|ftp)://[^\s)>\]]*[^\s)>\].,;:!?]")
+
+	def process_line(self, text):
+		blank		= not text.strip()
+		prev_blank	= self.blank
+		self.blank	= blank
+
+		if self.fence:
+			char, length = self.fence
+			match = self.re_fence.match(text)
+			if match and match.group(1)[0] == char and len(match.group(1)) >= length \
+			   and not text[match.end():].strip():
+				self.fence = None
+			return whole_line(text)
+
+		match = self.re_fence.match(text)
+		if match:
+			fence = match.group(1)
+			self.fence = (fence[0], len(fence))
+			return whole_line(text)
+
+		if blank:
+			return []
+
+		if self.re_code.match(text) and (prev_blank or self.code):
+			self.code = True
+			return whole_line(text)
+		self.code = False
+
+		if self.re_link.match(text):
+			# link reference definition
+			return whole_line(text)
+
+		ranges	= []
+		pos		= 0
+		while True:
+			match = self.re_inline.search(text, pos)
+			if not match:
+				break
+
+			s, e  = match.span()
+			token = match.group()
+			if token[0] == '`':
+				# inline code ends with the same number of backticks
+				end = text.find(token, e)
+				if end == -1:
+					pos = e
+					continue
+				e = end + len(token)
+			elif token[0] == ']':
+				s = s + 1	# link text is checked, target is not
+
+			ranges.append( (s, e) )
+			pos = e
+
+		return glue_ranges(ranges)
+
+class LaTeXFilter(Filter):
+	"""
+	LaTeXFilter leaves regular text; commands, comments, math
+	and verbatim environments, and arguments of commands which
+	don't contain text (labels, references, file names) are dead.
+	"""
+
+	# commands which arguments are dead
+	commands = sets.ImmutableSet([
+		'label', 'ref', 'eqref', 'pageref', 'cite', 'citep', 'citet',
+		'nocite', 'usepackage', 'documentclass', 'input', 'include',
+		'includegraphics', 'bibliography', 'bibliographystyle', 'url',
+		'href', 'newcommand', 'renewcommand', 'newenvironment',
+		'setlength', 'setcounter', 'hspace', 'vspace', 'pagestyle',
+		'thispagestyle', 'selectlanguage', 'color', 'textcolor',
+	])
+
+	# environments which contents are dead
+	environments = sets.ImmutableSet([
+		'equation', 'equation*', 'align', 'align*', 'alignat', 'alignat*',
+		'gather', 'gather*', 'multline', 'multline*', 'flalign', 'flalign*',
+		'eqnarray', 'eqnarray*', 'displaymath', 'math',
+		'verbatim', 'verbatim*', 'Verbatim', 'lstlisting', 'minted', 'comment',
+	])
+
+	re_text = None		# compiled once, see reset
+
+	def reset(self):
+		self.end	= None	# string closing math or environment
+
+		if LaTeXFilter.re_text == None:
+			LaTeXFilter.re_text = re.compile(
+				r"(?P<env>\\(?:begin|end)\s*\{(?P<name>[^}]*)\})|"
+				r"(?P<verb>\\verb\*?(?P<delim>[^\sA-Za-z*]).*?(?P=delim))|"
+				r"(?P<math>\$\$|\$|\\\(|\\\[)|"
+				r"(?P<command>\\[A-Za-z@]+\*?)|"
+				r"(?P<escape>\\.)|"
+				r"(?P<comment>%.*)"
+			)
+			LaTeXFilter.re_args	= re.compile(r"(?:\s*\[[^\]]*\])*(?:\s*\{[^}]*\})*")
+			LaTeXFilter.re_end	= {}	# closing string => regexp
+
+	def closing(self, end):
+		"Returns regexp finding end (escaped characters are skipped)"
+		if not self.re_end.has_key(end):
+			self.re_end[end] = re.compile(re.escape(end) + r"|\\.")
+		return self.re_end[end]
 
-class RAW:
+	def process_line(self, text):
+		ranges	= []
+		pos		= 0
+		start	= None	# start of math or environment
+
+		if self.end:
+			start = 0
+
+		while pos < len(text) or start != None:
+			if self.end:
+				# inside math or environment
+				regexp = self.closing(self.end)
+				while True:
+					match = regexp.search(text, pos)
+					if not match or match.group() == self.end:
+						break
+					pos = match.end()
+
+				if not match:
+					ranges.append( (start, len(text)) )
+					break
+
+				ranges.append( (start, match.end()) )
+				pos   = match.end()
+				start = None
+				self.end = None
+				continue
+
+			match = self.re_text.search(text, pos)
+			if not match:
+				break
+
+			s, e = match.span()
+			kind = match.lastgroup
+			if kind == 'env':
+				name = match.group('name').strip()
+				if text.startswith('\\begin', s) and name in self.environments:
+					start	 = s
+					self.end = '\\end{%s}' % name
+					pos		 = e
+					continue
+			elif kind == 'math':
+				start	 = s
+				self.end = {'$$': '$$', '$': '$', '\\(': '\\)', '\\[': '\\]'}[match.group()]
+				pos		 = e
+				continue
+			elif kind == 'command':
+				if match.group()[1:].rstrip('*') in self.commands:
+					e = self.re_args.match(text, e).end()
+
+			ranges.append( (s, e) )
+			pos = e
+
+		return glue_ranges(ranges)
+
+class ReSTFilter(Filter):
+	"""
+	ReSTFilter leaves regular text; literal blocks, comments,
+	directives (except text of admonitions and alike), inline
+	literals, roles, link targets and URLs are dead.
+	"""
+
+	# directives which arguments and contents are dead
+	directives = sets.ImmutableSet([
+		'code', 'code-block', 'sourcecode', 'highlight', 'math', 'raw',
+		'literalinclude', 'include', 'image', 'figure', 'csv-table',
+		'toctree', 'automodule', 'autoclass', 'autofunction', 'doctest',
+		'testcode', 'testoutput', 'productionlist', 'graphviz',
+	])
+
+	re_markup = None	# compiled once, see reset
+
+	def reset(self):
+		self.block		= None	# pair (indent, dead) of indented body
+		self.literal	= None	# indent of paragraph ending with '::'
+
+		if ReSTFilter.re_markup == None:
+			ReSTFilter.re_markup	= re.compile(r"\s*\.\.(?:\s+|$)(?:(?P<directive>[\w:+-]+)::|(?P<target>_[^:]*:)|(?P<subst>\|[^|]+\|\s+[\w:+-]+::))?")
+			ReSTFilter.re_option	= re.compile(r"\s+:[^:]+:")
+			ReSTFilter.re_inline	= re.compile(
+				r"``.+?``|"
+				r"(?::[\w:+-]+:)?`[^`]*`(?::[\w:+-]+:)?_{0,2}|"
+				r"\|[^|\s][^|]*\||"
+				r"(?:https?|ftp)://[^\s)>]*[^\s)>.,;:!?]"
+			)
+			ReSTFilter.re_target	= re.compile(r"<[^>]*>`")
+
+	def indent(self, text):
+		"Returns indentation of line"
+		return len(text) - len(text.lstrip())
+
+	def process_line(self, text):
+		if not text.strip():
+			if self.literal != None:
+				self.block		= (self.literal, True)
+				self.literal	= None
+			return []
+
+		indent = self.indent(text)
+		if self.block:
+			block_indent, dead = self.block
+			if indent > block_indent:
+				if dead:
+					return whole_line(text)
+				match = self.re_option.match(text)
+				if match:
+					return [(0, match.end())]
+				return self.inline(text, 0)
+			self.block = None
+
+		self.literal = None
+		match = self.re_markup.match(text)
+		if match:
+			directive = match.group('directive')
+			if directive:
+				if directive in self.directives:
+					self.block = (indent, True)
+					return whole_line(text)
+				else:
+					# text of admonition is checked
+					self.block = (indent, False)
+					return glue_ranges([(0, match.end())] + self.inline(text, match.end()))
+			else:
+				# comment, link target or substitution
+				self.block = (indent, True)
+				return whole_line(text)
+
+		if text.startswith('>>>'):
+			return whole_line(text)
+
+		if text.rstrip().endswith('::'):
+			# literal block follows
+			self.literal = indent
+
+		return self.inline(text, 0)
+
+	def inline(self, text, pos):
+		"Returns ranges of inline markup starting at pos"
+		ranges = []
+		while True:
+			match = self.re_inline.search(text, pos)
+			if not match:
+				break
+
+			s, e	= match.span()
+			token	= match.group()
+			if token[0] == '`' and token[-1] == '_' and token[1] != '`':
+				# `text <target>`_ -- text is checked
+				target = self.re_target.search(token)
+				if target:
+					ranges.append( (s + target.start(), e) )
+				pos = e
+				continue
+
+			ranges.append( (s, e) )
+			pos = e
+
+		return glue_ranges(ranges)
+
+# available filters: name => class
+FILTERS = {
+	'html'		: HTMLFilter,
+	'markdown'	: MarkdownFilter,
+	'latex'		: LaTeXFilter,
+	'rest'		: ReSTFilter,
+}
+
+# filters chosen by file extension
+FILTER_EXTENSIONS = {
+	'.html'		: 'html',
+	'.htm'		: 'html',
+	'.xhtml'	: 'html',
+	'.php'		: 'html',
+	'.md'		: 'markdown',
+	'.markdown'	: 'markdown',
+	'.tex'		: 'latex',
+	'.sty'		: 'latex',
+	'.rst'		: 'rest',
+	'.rest'		: 'rest',
+}
+
+def get_filter(name, filename=None):
+	"""
+	Returns filter object of given name; if name is None, filter
+	is chosen by extension of filename. Name 'text' means no filter.
+	"""
+	if name == None and filename:
+		import os.path
+		_, ext = os.path.splitext(filename)
+		name = FILTER_EXTENSIONS.get(ext.lower())
+
+	if name == None or name == 'text':
+		return None
+	else:
+		return FILTERS[name]()
+
+class Tokenizer:
+	"""
+	Splits line into fields in a single pass. Regular expressions
+	given as pairs (regexp, type) are joined into one alternation;
+	text between matches gets type 'mark' if it matches re_mark,
+	'__other__' otherwise; dead ranges get type '__fixed__'.
+	"""
+	def __init__(self, splits, re_mark, mark):
+		patterns	= []
+		flags		= 0
+		self.groups	= []	# pairs (group index, type)
+		group		= 1
+		for regexp, type in splits:
+			patterns.append('(%s)' % regexp.pattern)
+			flags = flags | regexp.flags
+			self.groups.append( (group, type) )
+			group = group + 1 + regexp.groups
+
+		self.regexp		= re.compile('|'.join(patterns), flags)
+		self.regexp_mark	= re_mark
+		self.mark_val		= mark
+
+	def __word(self, text, offset):
+		if self.regexp_mark.match(text):
+			return (text, offset, self.mark_val)
+		else:
+			return (text, offset, '__other__')
+
+	def __live(self, line, start, end):
+		pos = start
+		for match in self.regexp.finditer(line, start, end):
+			s, e = match.span()
+			if s > pos:
+				yield self.__word(line[pos:s], pos)
+
+			for group, type in self.groups:
+				if match.start(group) != -1:
+					yield (line[s:e], s, type)
+					break
+			pos = e
+
+		if pos < end:
+			yield self.__word(line[pos:end], pos)
+
+	def tokenize(self, line, ranges=None):
+		"""
+		Generator returns tuples (text, offset, type); ranges
+		is a list of dead fields (see Filter).
+		"""
+		pos = 0
+		if ranges:
+			for s, e in ranges:
+				for token in self.__live(line, pos, s):
+					yield token
+				yield (line[s:e], s, '__fixed__')
+				pos = e
+
+		for token in self.__live(line, pos, len(line)):
+			yield token
+
+class RAW(object):
 	"""
 	Random Access Words
+
+	Fields are kept in parallel lists (substrings and types);
+	offsets and string representation are calculated lazily,
+	when needed.
 	"""
-	
-	def __init__(self, text):
-		self.__lengthchanged = False	# length of string changed: update is needed
-		self.__stringchanged = False	# string is changed: update is needed
-		self.__str		= text		# string representation
-		self.__fields		= [ (text, (0,len(text)), None) ]
+	__slots__ = ('texts', 'types', 'offsets', 'string')
 
-	def __split(self, text, regexp, Match=True, NotMatch=False):
-		result = []
-		ps = 0
+	def __init__(self, text, tokens=None):
+		"""
+		tokens - optional list of tuples (text, offset, type)
+		         covering whole text (see Tokenizer)
+		"""
+		self.string = text		# string representation, None if changed
+		if tokens == None:
+			self.texts	= [text]
+			self.types	= [None]
+			self.offsets	= [0]
+		else:
+			self.texts	= [substring for substring, _, _ in tokens]
+			self.types	= [type for _, _, type in tokens]
+			self.offsets	= [offset for _, offset, _ in tokens]
+
+	def __split(self, text, regexp, Match, NotMatch):
+		texts = []
+		types = []
 		pe = 0
 		for match in regexp.finditer(text):
-			s = match.start()
-			e = match.end()
-
-			if s > pe: result.append( (text[pe:s], (0,0), NotMatch) )
+			s, e = match.span()
+			if s > pe:
+				texts.append(text[pe:s])
+				types.append(NotMatch)
 
-			result.append( (text[s:e], (0,0), Match) )
-			ps, pe = s, e
+			texts.append(text[s:e])
+			types.append(Match)
+			pe = e
 	
 		if pe < len(text):
-			result.append( (text[pe:], (0,0), NotMatch) )
+			texts.append(text[pe:])
+			types.append(NotMatch)
 
-		return result
+		return texts, types
 	
 	def __update(self):
-		if self.__lengthchanged:
+		if self.offsets == None:
+			offsets = []
 			start = 0
-			for index, item in enumerate(self.__fields):
-				substring, _, type = item
-			
-				s = start
-				l = len(substring)
-				self.__fields[index] = (substring, (s,l), type)
-				start = start + l
+			for substring in self.texts:
+				offsets.append(start)
+				start = start + len(substring)
+			self.offsets = offsets
 
-		if self.__stringchanged:
-			self.__str = "".join([substring for substring,_,_ in self.__fields])
+		if self.string == None:
+			self.string = "".join(self.texts)
+
+	def __changed(self):
+		self.offsets	= None
+		self.string	= None
 	
 	def split_field(self, index, regexp, Match, NotMatch):
 		"""split given field"""
-		self.__lengthchanged	= True
-		self.__stringchanged	= True
-		
-		text	= self.__fields[index][0]
-		tmp		= self.__split(text, regexp, Match, NotMatch)
-		self.__fields = self.__fields[:index] + tmp + self.__fields[index+1:]
+		texts, types = self.__split(self.texts[index], regexp, Match, NotMatch)
+		self.texts[index:index+1] = texts
+		self.types[index:index+1] = types
+		self.__changed()
 
 	def split_fields(self, pred, regexp, Match, NotMatch):
 		"""
@@ -369,14 +797,21 @@ class RAW:
 		If pred is None all fields are splitted.
 		Pred gets following argumens: substring, start, end, optional.
 		"""
-		if pred:
-			indexes = [i for i in xrange(len(self.__fields)) if pred(*self.__fields[i])]
-		else:
-			indexes = range(len(self.__fields))
+		self.__update()
+		texts = []
+		types = []
+		for substring, offset, type in zip(self.texts, self.offsets, self.types):
+			if pred == None or pred(substring, (offset, len(substring)), type):
+				t1, t2 = self.__split(substring, regexp, Match, NotMatch)
+				texts.extend(t1)
+				types.extend(t2)
+			else:
+				texts.append(substring)
+				types.append(type)
 
-		indexes.reverse()
-		for i in indexes:
-			self.split_field(i, regexp, Match, NotMatch)
+		self.texts = texts
+		self.types = types
+		self.__changed()
 	
 	def split_constant_field(self, index, list, Inside, Outside):
 		"""
@@ -394,17 +829,13 @@ class RAW:
 			 ("152", (..), 'number']
 		"""
 		if list == None or len(list) == 0:
-			substring, se, _ = self.__fields[index]
-			self.__fields[index] = (substring, se, Outside)
+			self.types[index] = Outside
 			return
 		
-		self.__lengthchanged	= True
-		self.__stringchanged	= True
-
-		text = self.__fields[index][0]
-		tmp  = []
+		text  = self.texts[index]
+		texts = []
+		types = []
 
-		ps = 0
 		pe = 0
 		for i, item in enumerate(list):
 			s, e = item
@@ -412,34 +843,34 @@ class RAW:
 				raise ValueError("Invalid range (%d,%d) at index %d" % (s, e, i) )
 
 			if s > pe:
-				tmp.append( (text[pe:s], (0,0), Outside) )
+				texts.append(text[pe:s])
+				types.append(Outside)
 
-			tmp.append( (text[s:e], (0,0), Inside) )
-			ps, pe = s, e
+			texts.append(text[s:e])
+			types.append(Inside)
+			pe = e
 		
 		if pe < len(text):
-			tmp.append( (text[pe:], (0,0), Outside) )
+			texts.append(text[pe:])
+			types.append(Outside)
 
-		self.__fields = self.__fields[:index] + tmp + self.__fields[index+1:]
+		self.texts[index:index+1] = texts
+		self.types[index:index+1] = types
+		self.__changed()
 	
 	def __iter__(self):
-		"""start iteration"""
+		"""iterate over tuples (substring, (start, length), type)"""
 		self.__update()
-		self.__index = 0
-		return self
-	
-	def next(self):
-		"""next iteration"""
-		if self.__index >= len(self.__fields):
-			raise StopIteration
-
-		field = self.__fields[self.__index]
-		self.__index = self.__index + 1
-		return field
+		texts	= self.texts
+		offsets	= self.offsets
+		types	= self.types
+		for index in xrange(len(offsets)):
+			yield (texts[index], (offsets[index], len(texts[index])), types[index])
 
 	def __getitem__(self, index):
 		self.__update()
-		return self.__fields[index]
+		substring = self.texts[index]
+		return (substring, (self.offsets[index], len(substring)), self.types[index])
 
 	def __setitem__(self, index, value):
 		"""
@@ -448,31 +879,35 @@ class RAW:
 		2. object[index] = (string, type) -- overrides both substring
 		                                     and type fields
 		"""
-		import types
 		if isinstance(value, types.StringType):
 			substring = value
-			type = self.__fields[index][2]
 		else:
-			substring, type = value
+			substring, self.types[index] = value
 
-		self.__stringchanged = True
-		self.__lengthchanged = self.__lengthchanged or len(substring) != len(self.__fields[index][0])
-		
-		self.__fields[index] = (substring, (0,0), type)
+		if len(substring) != len(self.texts[index]):
+			self.offsets = None
+		self.string = None
+		self.texts[index] = substring
 	
 	def __delitem__(self, index):
-		del self.__fields[index]
+		del self.texts[index]
+		del self.types[index]
+		self.__changed()
 	
 	def __len__(self):
-		return len(self.__fields)
+		return len(self.texts)
 
 	def __str__(self):
 		self.__update()
-		return self.__str
+		return self.string
 
 class SpellerEditor:
 
 	def __init__(self, file_handle, re_split1, split1, re_split2, split2, re_mark, mark, filter=None):
+		"""
+		If file_handle is None, editor is used only to split
+		lines (see split).
+		"""
 
 		self.regexp_split1	= re_split1
 		self.regexp_split2	= re_split2
@@ -480,46 +915,71 @@ class SpellerEditor:
 		self.split1_val		= split1
 		self.split2_val		= split2
 		self.mark_val		= mark
+		self.tokenizer		= Tokenizer([(re_split1, split1), (re_split2, split2)], re_mark, mark)
+
+		# Text of file is kept in a single buffer (memory-mapped if
+		# possible); line i spans buffer[starts[i]:starts[i+1]-1].
+		# Only ranges of lines having dead fields and lines being
+		# edited (or changed) are stored separately.
+		self.buffer	= ''
+		self.starts	= array.array('l', [0])
+		self.ranges	= {}	# line number => list of dead fields
+		self.changed	= {}	# line number => RAW or string
+		if file_handle == None:
+			return
+
+		self.buffer = buffer = self.load(file_handle)
+		size = len(buffer)
+		pos  = 0
+		while pos < size:
+			end = buffer.find('\n', pos)
+			if end == -1:
+				end = size
+			self.starts.append(end + 1)
+			pos = end + 1
 
 		if filter:
-			filter.reset()
+			lines = (self.original(line_num) for line_num in xrange(len(self)))
+			for line_num, (_, ranges) in enumerate(filter.process(lines)):
+				if ranges:
+					self.ranges[line_num] = ranges
+
+	def load(self, file_handle):
+		"""Returns contents of file: memory-mapped if it's regular file"""
+		import mmap, stat
+		try:
+			fd = file_handle.fileno()
+			st = os.fstat(fd)
+		except (AttributeError, EnvironmentError):
+			return file_handle.read()
+
+		if not stat.S_ISREG(st.st_mode):
+			return file_handle.read()
+		elif st.st_size == 0:
+			return ''	# mmap refuses empty files
+		else:
+			return mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
 
-		self.Lines = []
-		for line in file_handle:
-			if line[-1] == os.linesep:
-				line = line[:-1]
+	def original(self, line_num):
+		"""Returns line as read from file"""
+		return self.buffer[self.starts[line_num]:self.starts[line_num+1]-1]
 
-			if filter:
-				ranges = filter.process_line(line)
-			else:
-				ranges = None
-	
-			self.Lines.append( (line, ranges) )
+	def split(self, line, ranges):
+		"""Returns RAW object of line; ranges are dead fields"""
+		return RAW(line, list(self.tokenizer.tokenize(line, ranges)))
 
 	def edit(self, line_num):
-		if not isinstance(self.Lines[line_num][0], RAW):
-
-			line, ranges = self.Lines[line_num]
-			tmp = RAW(line)
-
-			tmp.split_constant_field(0, ranges, '__fixed__', None)
-
-			tmp.split_fields(lambda dummy1,dummy2,type: type==None, self.regexp_split1, self.split1_val, None)
-			tmp.split_fields(lambda dummy1,dummy2,type: type==None, self.regexp_split2, self.split2_val, None)
-			for index, item in enumerate(tmp):
-				substring, _, type = item
-				if type == None:
-					if self.regexp_mark.match(substring):
-						tmp[index] = (substring, self.mark_val)
-					else:
-						tmp[index] = (substring, '__other__')
-
-			self.Lines[line_num] = (tmp, ranges)
+		if not isinstance(self.changed.get(line_num), RAW):
+			self.changed[line_num] = self.split(self.line(line_num), self.ranges.get(line_num))
 		
 	def save(self, line_num):
-		if isinstance(self.Lines[line_num][0], RAW):
-			tmp, ragnes = self.Lines[line_num]
+		tmp = self.changed.get(line_num)
+		if isinstance(tmp, RAW):
 			text = str(tmp)
+			if text == self.original(line_num):
+				# line not changed, drop the copy
+				del self.changed[line_num]
+				return
 
 			# recalculate ranges
 			ranges = []
@@ -529,38 +989,31 @@ class SpellerEditor:
 					e   = s + l
 					ranges.append( (s,e) )
 
-			self.Lines[line_num] = (text, ranges)
+			self.changed[line_num] = text
+			if ranges:
+				self.ranges[line_num] = ranges
+			elif self.ranges.has_key(line_num):
+				del self.ranges[line_num]
 	
 	def __len__(self):
-		return len(self.Lines)
+		return len(self.starts) - 1
 
 	def __getitem__(self, line_num):
-		return self.Lines[line_num][0]
+		if self.changed.has_key(line_num):
+			return self.changed[line_num]
+		else:
+			return self.original(line_num)
 
 	def __iter__(self):
-		self.index = 0
-		return self
-	
-	def next(self):
-		if self.index == len(self.Lines):
-			raise StopIteration
-		
-		f = self.Lines[self.index][0]
-		self.index = self.index + 1
-		return f
+		for line_num in xrange(len(self)):
+			yield self[line_num]
 	
 	def line(self, line_num):
-		if isinstance(self.Lines[line_num][0], RAW):
-			return str(self.Lines[line_num][0])
-		else:
-			return self.Lines[line_num][0]
+		return str(self[line_num])
 	
 	def iterlines(self):
-		for line, _ in self.Lines:
-			if isinstance(line, RAW):
-				yield str(line)
-			else:
-				yield line
+		for line_num in xrange(len(self)):
+			yield self.line(line_num)
 
 def clone_case(word1, word2):
 	"""
@@ -569,21 +1022,28 @@ def clone_case(word1, word2):
 
 	If word1 is not upper/lower/capitlize and it's length is different
 	then word2's length then unchanged word2 is returned.
+
+	Case of polish letters is changed regardless of locale.
 	"""
-	
-	if word1.isupper():
-		return word2.upper()
-	elif word1.islower():
-		return word2.lower()
-	elif word1[0].isupper() and word1[1:].islower():
-		return word2.capitalize()
+	def isupper(word):
+		return word == pl_upper(word) and word != pl_lower(word)
+
+	def islower(word):
+		return word == pl_lower(word) and word != pl_upper(word)
+
+	if isupper(word1):
+		return pl_upper(word2)
+	elif islower(word1):
+		return pl_lower(word2)
+	elif isupper(word1[0]) and islower(word1[1:]):
+		return pl_upper(word2[:1]) + pl_lower(word2[1:])
 	elif len(word1) == len(word2):
 		word2 = list(word2)
 		for i in xrange(len(word1)):
-			if word1[i].isupper():
-				word2[i] = word2[i].upper()
+			if isupper(word1[i]):
+				word2[i] = pl_upper(word2[i])
 			else:
-				word2[i] = word2[i].lower()
+				word2[i] = pl_lower(word2[i])
 		return "".join(word2)
 	else:
 		return word2
@@ -625,8 +1085,6 @@ def comb(list):
 		if carry == 1:
 			break
 
-import sets
-
 # [a-z󶿼][󶿼][a-z󶿼]
 # all possible neigbours of polish diacritical characters
 pl_triples = sets.Set([
@@ -831,193 +1289,1494 @@ pl_triples = sets.Set([
 'k', 'm', 'n', 'o', 'u', 'y', 'z', '',
 '', '', '', 'c', 'm', 'z', ''])
 
-def possible_plwords(word):
+# latin characters used instead of polish diacritical characters
+# (PDC) -> PDC
+pl_replacements = {
+	'a' : '',
+	'c' : '',
+	'e' : '',
+	'l' : '',
+	'n' : '',
+	'o' : '',
+	's' : '',
+	'z' : '',
+}
+
+def compile_triples(triples):
+	"""
+	Compiles set of triples into a table indexed by
+	ord(a) << 8 | ord(c); each item is a bit mask of PDC b
+	for which a+b+c is a valid triple.
+	
+	Returns pair: table and dictionary mapping latin
+	character X to list of strings indexed by bit mask;
+	string contains X and all PDC replacing X allowed by mask.
+	"""
+	bits = {}
+	for pdc in "".join(pl_replacements.values()):
+		bits[pdc] = 1 << len(bits)
+
+	table = array.array('H', [0]) * 65536
+	for a, b, c in triples:
+		table[ord(a) << 8 | ord(c)] |= bits[b]
+
+	choices = {}
+	for X, pdcs in pl_replacements.items():
+		choices[X] = []
+		for mask in xrange(1 << len(bits)):
+			choices[X].append(X + "".join([b for b in pdcs if mask & bits[b]]))
+
+	return table, choices
+
+# compiled on first use (see plword_alternatives)
+pl_table = pl_choices = None
+
+def plword_alternatives(word):
+	"""
+	Returns list of strings; i-th string contains all characters
+	that may appear at i-th position of polish word 'word'
+	(see comb).
+	"""
 	# polish diacritical characters (PDC) that may appear
 	# at begin and end of word
 	allowed_at_begin = '󶿼'
 	allowed_at_end   = '񶿼'
 
-	# latin characters used instead of PDC
-	platin = 'acelnosz'
-
-	# platin -> PDC
-	repl   = {'a':'a',
-	          'c':'c',
-		  'e':'e',
-		  'l':'l',
-		  'n':'n',
-		  'o':'o',
-		  's':'s',
-		  'z':'z'}
-
 	L  = list(word)
 
 	# make list of possible chars at end and begin of word
 	if L[0] in 'clnosz':	# without_PDC(allowed_at_begin)
-		L[0] = repl[L[0]]
+		L[0] = L[0] + pl_replacements[L[0]]
 	if L[-1] in 'acelnsz':	# without_PDC(allowed_at_end)
-		L[-1] = repl[L[-1]]
+		L[-1] = L[-1] + pl_replacements[L[-1]]
 	
-	# make list of possible PDC insied of word
+	# make list of possible PDC insied of word: mask of PDC
+	# allowed between neighbours a and c selects the string
+	global pl_table, pl_choices
+	if pl_table == None:
+		pl_table, pl_choices = compile_triples(pl_triples)
+
+	table	= pl_table
+	codes	= map(ord, word)
 	for i in xrange(1,len(word)-1):
-		if L[i] not in platin:
-			continue
+		choices = pl_choices.get(word[i])
+		if choices:
+			L[i] = choices[table[codes[i-1] << 8 | codes[i+1]]]
 
-		a,X,c = word[i-1:i+2]
-		# create all possible triples with neigbours a and c
-		for b in repl[X]:
-			if a+b+c in pl_triples:
-				L[i] += b
+	return L
 
-	# return list
+def possible_plwords(word, ngrams=None):
+	"""
+	Returns list of all possible polish words; if ngrams (NgramModel)
+	is given, words containing unknown n-grams are skipped.
+	"""
+	if ngrams != None:
+		return list(ngrams.walk(plword_alternatives(word)))
 
 	tmp = []
-	for i in comb(L):
+	for i in comb(plword_alternatives(word)):
 		tmp.append( "".join(i) )
 	
 	return tmp
 
-
-class Speller:
+def read_words(filename):
 	"""
-	Speller wrapper. Provides cache for both check() and suggest() methods.
+	Generator returns words from a word list; there can be
+	one or more words in line. If filename is '-' words are
+	read from stdin.
 	"""
+	if filename == '-':
+		file = sys.stdin
+	else:
+		file = open(filename, 'r')
 
-	def __init__(self, speller, dict_cache=None, sugg_cache=None):
-		self.speller = speller
-
-		self.__dict_cache	= dict_cache
-		self.__sugg_cache	= sugg_cache
-		self.dict = {}
-		self.sugg = {}
+	for line in file:
+		for word in line.split():
+			yield word
 
-		import cPickle
-		if self.__sugg_cache:
-			try:
-				self.sugg = cPickle.load( open(self.__sugg_cache, 'r') )
-			except (IOError, EOFError):
-				self.sugg = {}
+class WordList:
+	"""
+	Sorted list of distinct words (lower case) packed into one
+	string; array of offsets of words takes 4 bytes per word,
+	so memory usage is close to the size of the words themselves,
+	even for a list of all polish forms. Words and prefixes are
+	looked up by bisection.
+	"""
+	def __init__(self, words=None):
+		unique = {}
+		if words:
+			for word in words:
+				unique[word.lower()] = True
 
-		if self.__dict_cache:
-			try:
-				self.dict = cPickle.load( open(self.__dict_cache, 'r') )
-			except (IOError, EOFError):
-				self.dict = {}
-			
-	def save_dict(self, file=None):
-		import cPickle
-		if file == None:
-			file = self.__dict_cache
-		if file != None:
-			cPickle.dump(self.dict, open(file, 'w'), cPickle.HIGHEST_PROTOCOL)
-	
-	def save_sugg(self, file=None):
-		import cPickle
-		if file == None:
-			file = self.__sugg_cache
-		if file != None:
-			cPickle.dump(self.sugg, open(file, 'w'), cPickle.HIGHEST_PROTOCOL)
+		words = unique.keys()
+		del unique
+		words.sort()
 
-	def check(self, word):
-		lword = word.lower()
-		if not self.dict.has_key(lword):
-			self.dict[lword] = self.speller.check(lword)
-		
-		return self.dict[lword]
-	
-	def suggest(self, word):
-		lword = word.lower()
-		if not self.sugg.has_key(lword):
-			self.sugg[lword] = self.speller.suggest(lword)
-		
-		return self.sugg[lword]
+		self.starts	= array.array('I', [0])
+		pos = 0
+		for word in words:
+			pos = pos + len(word) + 1
+			self.starts.append(pos)
+
+		self.data	= '\n'.join(words) + '\n'
+		self.count	= len(words)
+
+	def word(self, i):
+		"""Returns i-th word"""
+		return self.data[self.starts[i]:self.starts[i+1]-1]
+
+	def bisect(self, key, lo=0, hi=None):
+		"""Returns index of the first word not less than key"""
+		if hi == None:
+			hi = self.count
+
+		data	= self.data
+		starts	= self.starts
+		while lo < hi:
+			mid = (lo + hi)/2
+			if data[starts[mid]:starts[mid+1]-1] < key:
+				lo = mid + 1
+			else:
+				hi = mid
+		return lo
 
-class PolishSpeller:
-	def __init__(self, speller, sugg_cache=None):
-		self.speller	= speller
-		self.sugg	= {}
-		self.repl	= {}
-		self.__sugg_cache = sugg_cache
+	def __contains__(self, word):
+		i = self.bisect(word)
+		return i < self.count and self.word(i) == word
 
-		if self.__sugg_cache:
-			import cPickle
-			try:
-				self.sugg = cPickle.load( open(self.__sugg_cache, 'r') )
-			except (IOError, EOFError):
-				self.sugg = {}
-	
-	def save_sugg(self, file=None):
-		import cPickle
-		if file == None:
-			file = self.__sugg_cache
-		if file != None:
-			cPickle.dump(self.sugg, open(file, 'w'), cPickle.HIGHEST_PROTOCOL)
+	def __len__(self):
+		return self.count
 
-	def __suggest(self, word):
-		lword = word.lower()
-		word_list = possible_plwords(lword)
-		self.sugg[lword] = [word for word in word_list if self.speller.check(word)]
+	def walk(self, alternatives):
+		"""
+		Generator returns all words from list that could be
+		built from list of alternatives (see comb). Words having
+		common prefix form a range of the list, which is narrowed
+		in lockstep with the list of alternatives, thus prefixes
+		that don't lead to any word are pruned immediately.
+		"""
+		n = len(alternatives)
+		stack = [(0, self.count, 0, '')]
+		while stack:
+			lo, hi, i, prefix = stack.pop()
+			if i == n:
+				# prefix itself is the first word of range
+				if self.word(lo) == prefix:
+					yield prefix
+				continue
 
-	def add_replacement(self, word, replacement):
-		self.repl[word] = [replacement]
-	
-	def clear_replacement(self):
-		self.repl = {}
+			chars = list(alternatives[i])
+			chars.reverse()
+			for c in chars:
+				start = self.bisect(prefix + c, lo, hi)
+				if ord(c) < 255:
+					end = self.bisect(prefix + chr(ord(c) + 1), start, hi)
+				else:
+					end = hi
+				if start < end:
+					stack.append( (start, end, i+1, prefix + c) )
 
-	def suggest(self, word):
-		if self.repl.has_key(word):
-			return self.repl[word]
+# polish diacritical characters and their latin counterparts
+pl_letters		= '󶼿ʣӦ'
+latin_letters	= 'acelnoszzACELNOSZZ'
 
-		lword = word.lower()
-		if not self.sugg.has_key(lword):
-			self.__suggest(lword)
+import string
+deaccent_table = string.maketrans(pl_letters, latin_letters)
 
-		return self.sugg[lword]
+def deaccent(word):
+	"""Replaces polish diacritical characters with latin ones"""
+	return word.translate(deaccent_table)
 
+# case of polish letters is changed with tables, so it doesn't
+# depend on locale set by the program (see clone_case)
+lower_letters	= string.ascii_lowercase + pl_letters[:9]
+upper_letters	= string.ascii_uppercase + pl_letters[9:]
+upper_table		= string.maketrans(lower_letters, upper_letters)
+lower_table		= string.maketrans(upper_letters, lower_letters)
 
-VERSION = "$Revision: 1.2 $"
+def pl_upper(word):
+	return word.translate(upper_table)
 
-def fileok(filename):
-	"""Check if we can try to check file"""
-	if not os.path.exists(filename): # dosn't exist
-		Info("Plik '%s' nie istnieje." % filename)
-		return False
-	if not os.path.isfile(filename): # is not file
-		Info("'%s' nie jest plikiem." % filename)
-		return False
-	elif os.path.getsize(filename) == 0:
-		Info("Plik '%s' jest pusty." % filename)
-		return False
-	else:
-		return True
+def pl_lower(word):
+	return word.translate(lower_table)
 
-def Question(prompt, options, default=None, propagate_break=True):
+class WordListSpeller:
 	"""
-	prompt  - string
-	options - list of tuples:
-	           1. value
-	           2. string or list of strings assinged to value
-	              first string is displaying
-	default_value	- value returned on press Enter
-	propagate_break	- Ctrl-C is propagate to caller
+	Speller backend using a word list instead of aspell (see
+	Speller). The WordList is shared with PolishSpeller, so it's
+	kept in memory only once; check() is a single bisection.
+	Suggestions are words of the list which differ in one letter
+	(missing, extra, replaced or two letters swapped).
 	"""
+	def __init__(self, words):
+		"""words - WordList"""
+		self.words		= words
+		self.letters	= None	# letters used by words, see suggest
 
-	values = {}
-	opt = []
-	df  = None
-	for value, item in options:
-		if isinstance(item, types.StringType):
-			item = [item]
+	def __len__(self):
+		return len(self.words)
 
-		if not isinstance(item, (types.ListType, types.TupleType)):
-			raise TypeError("list or tuple is required")
+	def check(self, word):
+		return word in self.words
 
-		if df == None and value == default:
-			if len(item[0]) == 1:
-				opt.append(item[0].upper())
-			else:
-				opt.append(item[0])
-		else:
+	def suggest(self, word):
+		"""
+		Returns words at edit distance 1; words differing only in
+		polish diacritical characters go first.
+		"""
+		if self.letters == None:
+			self.letters = sets.ImmutableSet(self.words.data) - sets.ImmutableSet('\n')
+
+		n		= len(word)
+		splits	= [(word[:i], word[i:]) for i in xrange(n + 1)]
+		edits	= sets.Set()
+		for a, b in splits:
+			if b:
+				edits.add(a + b[1:])
+			if len(b) > 1:
+				edits.add(a + b[1] + b[0] + b[2:])
+			for c in self.letters:
+				if b:
+					edits.add(a + c + b[1:])
+				edits.add(a + c + b)
+
+		edits.discard(word)
+		result = [w for w in edits if w in self.words]
+		plain = deaccent(word)
+		result.sort(key=lambda w: (deaccent(w) != plain, w))
+		return result
+
+def aspell_backend(words=None):
+	"""Returns aspell speller of polish (word list is not used)"""
+	import aspell
+	return aspell.Speller('lang', 'pl')
+
+# speller backends (see Speller); each is a function which returns
+# object providing check() and suggest() for a given WordList
+BACKENDS = {
+	'aspell'	: aspell_backend,
+	'words'		: WordListSpeller,
+}
+
+class SortedIndex:
+	"""
+	Read-only index kept in a text file of lines
+	"key<TAB>value<TAB>value...", sorted by key.
+	
+	File is memory-mapped on first lookup and searched
+	with bisection, so nothing is deserialized at startup
+	and processes share the same pages.
+	"""
+	def __init__(self, path):
+		self.path	= path
+		self.map	= None
+
+	def open(self):
+		"""map file into memory"""
+		import mmap
+		file = open(self.path, 'rb')
+		if os.path.getsize(self.path) == 0:
+			self.map = ''	# mmap refuses empty files
+		else:
+			self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+		file.close()
+	
+	def lookup(self, key):
+		"""Returns list of values assigned to key, None if key not found"""
+		if self.map == None:
+			self.open()
+
+		map = self.map
+		lo	= 0
+		hi	= len(map)
+		while lo < hi:
+			# find line containing middle byte
+			mid		= (lo + hi)/2
+			start	= map.rfind('\n', lo, mid) + 1
+			if start == 0:
+				start = lo
+			end		= map.find('\n', start)
+			if end == -1:
+				end = len(map)
+
+			fields = map[start:end].split('\t')
+			if fields[0] < key:
+				lo = end + 1
+			elif fields[0] > key:
+				hi = start
+			else:
+				return fields[1:]
+
+		return None
+
+	def __contains__(self, key):
+		return self.lookup(key) != None
+
+	def size(self):
+		"""Returns number of entries (lines) and bytes of file"""
+		lines = 0
+		file = open(self.path, 'rb')
+		while True:
+			chunk = file.read(1024*1024)
+			if not chunk:
+				break
+			lines = lines + chunk.count('\n')
+		file.close()
+		return lines, os.path.getsize(self.path)
+
+	def items(self):
+		"""Generator returns all pairs (key, list of values) in key order"""
+		if self.map == None:
+			self.open()
+
+		map = self.map
+		start = 0
+		while start < len(map):
+			end = map.find('\n', start)
+			if end == -1:
+				end = len(map)
+
+			fields = map[start:end].split('\t')
+			yield (fields[0], fields[1:])
+			start = end + 1
+
+def write_index(path, items):
+	"""
+	Writes items -- pairs (key, list of values) sorted by key --
+	in format read by SortedIndex. Keys and values must not
+	contain tabs nor newlines. Returns number of items.
+	"""
+	tmpname = tmpfilename(os.path.dirname(path) or '.', 'tmp-')
+	file = open(tmpname, 'wb')
+	n = 0
+	for key, values in items:
+		file.write('\t'.join([key] + list(values)) + '\n')
+		n = n + 1
+	file.close()
+	os.rename(tmpname, path)
+	return n
+
+class NgramModel:
+	"""
+	Set of character n-grams learned from polish words. Word is
+	surrounded by '^' and '$' and n-gram ending at each character
+	is taken (n-grams at begin of word are shorter). Only n-grams
+	containing polish diacritical characters are kept, as only
+	they restrict possible polish words.
+
+	N-grams are kept in a file written by write_index, which is
+	read on first use.
+	"""
+	def __init__(self, path=None):
+		self.path	= path
+		self.grams	= None
+		self.n		= 0
+
+	def load(self):
+		self.grams = {}
+		for line in open(self.path, 'rb'):
+			gram = line.rstrip('\n')
+			self.grams[gram] = True
+			self.n = max(self.n, len(gram))
+
+	def __len__(self):
+		if self.grams == None:
+			self.load()
+		return len(self.grams)
+
+	def walk(self, alternatives):
+		"""
+		Generator returns all words that could be built from list
+		of alternatives (see comb) and contain only known n-grams.
+		Words are built char by char, thus prefixes having unknown
+		n-gram are pruned immediately.
+		"""
+		if self.grams == None:
+			self.load()
+
+		grams	= self.grams
+		n		= self.n
+		last	= len(alternatives)
+		# items: prefix (with '^'), index of last polish character
+		stack	= [('^', -1)]
+		while stack:
+			prefix, pdc = stack.pop()
+			i = len(prefix)	# position of next char in prefix
+			if i > last:
+				# n-gram ending at '$'
+				if pdc >= 0 and pdc > i-n and not grams.has_key((prefix + '$')[-n:]):
+					continue
+				yield prefix[1:]
+				continue
+
+			chars = list(alternatives[i-1])
+			chars.reverse()
+			for c in chars:
+				if c in pl_letters:
+					p = i
+				else:
+					p = pdc
+				# n-gram ending at c contains polish character
+				if p >= 0 and p > i-n and not grams.has_key((prefix + c)[-n:]):
+					continue
+				stack.append( (prefix + c, p) )
+
+def corpus_words(words):
+	"""
+	Generator returns lower case words made of polish letters
+	found in words (see read_words); punctuation, digits and
+	other characters are skipped.
+	"""
+	re_word = re.compile('[a-zA-Z%s]+' % pl_letters)
+	for word in words:
+		for word in re_word.findall(word):
+			yield word.lower()
+
+def build_ngrams(words, path, n=4):
+	"""
+	Learns n-grams of polish words (see NgramModel) and
+	saves them. Returns number of n-grams.
+	"""
+	grams = {}
+	for word in corpus_words(words):
+		if word == deaccent(word):
+			continue
+		word = '^' + word + '$'
+		for i in xrange(1, len(word)):
+			gram = word[max(0, i-n+1):i+1]
+			for c in gram:
+				if c in pl_letters:
+					grams[gram] = True
+					break
+
+	items = [(gram, []) for gram in grams]
+	items.sort()
+	write_index(path, items)
+	return len(items)
+
+class FrequencyIndex(SortedIndex):
+	"""
+	Index of numbers of occurrences of words or sequences
+	of words in corpus (see build_freq and build_bigrams).
+	"""
+	def count(self, *words):
+		"""Returns number of occurrences of word (or words)"""
+		values = self.lookup(' '.join(words))
+		if values:
+			return int(values[0])
+		else:
+			return 0
+
+def build_freq(words, path):
+	"""
+	Counts occurrences of words in corpus and saves them as
+	FrequencyIndex. Returns number of distinct words.
+	"""
+	counts = {}
+	for word in corpus_words(words):
+		counts[word] = counts.get(word, 0) + 1
+
+	items = [(word, [str(n)]) for word, n in counts.iteritems()]
+	items.sort()
+	write_index(path, items)
+	return len(items)
+
+def build_bigrams(words, path):
+	"""
+	Counts occurrences of pairs of adjacent words in corpus and
+	saves them as FrequencyIndex. Returns number of distinct keys.
+
+	Neighbours of a corrected word usually lack polish diacritical
+	characters too, thus each pair "a b" is counted twice: as word
+	b after a without PDC (key "deaccent(a) b <") and as word a
+	before b without PDC (key "a deaccent(b) >"); see
+	PolishSpeller.disambiguate.
+	"""
+	counts	= {}
+	prev	= None
+	for word in corpus_words(words):
+		if prev != None:
+			for key in (deaccent(prev) + ' ' + word + ' <', prev + ' ' + deaccent(word) + ' >'):
+				counts[key] = counts.get(key, 0) + 1
+		prev = word
+
+	items = [(pair, [str(n)]) for pair, n in counts.iteritems()]
+	items.sort()
+	write_index(path, items)
+	return len(items)
+
+def build_plindex(words, path):
+	"""
+	Builds index that maps words without polish diacritical
+	characters to all their forms found in words list.
+	Returns number of keys.
+	"""
+	index = {}
+	for word in words:
+		word = word.lower()
+		index.setdefault(deaccent(word), {})[word] = True
+	
+	items = [(key, forms.keys()) for key, forms in index.iteritems()]
+	items.sort()
+	write_index(path, items)
+	return len(items)
+
+class DiskCache:
+	"""
+	Persistent cache which maps word to list of strings.
+
+	Saved entries live in a SortedIndex file and are probed
+	word by word, thus opening a cache costs nothing regardless
+	of its size. New entries are kept in memory and at once
+	appended to a journal (file path + '.log'), so they survive
+	a crash or Ctrl-C. When the journal grows above compact_limit
+	records and half of the entries of index file, it is merged
+	into the index file (see compact); thus rewriting of index
+	costs amortized constant time per new entry.
+
+	Readonly cache never writes to disk; entries added to it
+	can be retrieved with learned() and merged into another
+	cache (see merge).
+
+	Size of cache can be limited with max_entries and max_bytes;
+	then least recently ('lru') or least frequently ('lfu') used
+	entries are evicted during compaction. Every record keeps
+	its use count and time of last use for this purpose. Number
+	of entries and bytes of index file are kept in file
+	path + '.size', so limits are checked without reading it.
+
+	Caches saved by older versions (cPickle) are read once and
+	converted on next save.
+	"""
+	def __init__(self, path=None, compact_limit=10000, max_entries=None, max_bytes=None, policy='lru', readonly=False):
+		if policy not in ['lru', 'lfu']:
+			raise ValueError("Unknown eviction policy '%s'" % policy)
+
+		import time
+		self.clock	= time.time
+
+		self.path	= path
+		self.new	= {}	# entries not merged into index yet
+		self.meta	= {}	# (use count, last use) of entries from self.new
+		self.touched	= {}	# entries from index used in this session
+		self.reported	= {}	# entries returned by learned()
+		self.index	= None
+		self.indexed	= (0, 0)	# entries and bytes of index file
+		self.loaded	= False
+		self.convert	= False	# old format has been read
+		self.readonly	= readonly
+
+		self.compact_limit	= compact_limit
+		self.journal		= None
+		self.journaled		= 0	# number of records in journal
+		if path != None:
+			self.journal_path	= path + '.log'
+			self.size_path		= path + '.size'
+		else:
+			self.journal_path	= None
+			self.size_path		= None
+
+		self.max_entries	= max_entries
+		self.max_bytes		= max_bytes
+		self.policy			= policy
+		self.bounded		= max_entries != None or max_bytes != None
+
+		self.hits		= 0
+		self.misses		= 0
+		self.evictions	= 0
+
+	def encode(self, value):
+		"""convert value to list of strings"""
+		return value
+
+	def decode(self, values):
+		"""convert list of strings to value"""
+		return values
+
+	def __split(self, fields):
+		"""split stored fields into (use count, last use) and values"""
+		if fields and fields[0][:1] == '@':
+			count, stamp = fields[0][1:].split(':')
+			return (int(count), int(stamp)), fields[1:]
+		else:
+			return (0, 0), fields	# saved by older version
+
+	def __fields(self, key, value):
+		count, stamp = self.meta.get(key, (0, 0))
+		return ['@%d:%d' % (count, stamp)] + list(self.encode(value))
+
+	def __load(self):
+		self.loaded = True
+		if self.path == None:
+			return
+
+		if os.path.isfile(self.path):
+			file = open(self.path, 'rb')
+			magic = file.read(2)
+			if magic == '\x80\x02':	# cPickle.HIGHEST_PROTOCOL
+				import cPickle
+				file.seek(0)
+				try:
+					self.new = cPickle.load(file)
+				except (EOFError, cPickle.UnpicklingError):
+					self.new = {}
+				self.convert = True
+			else:
+				self.index = SortedIndex(self.path)
+			file.close()
+			if self.index != None:
+				self.indexed = self.__read_size()
+
+		# replay journal; last line may be incomplete after a crash
+		if os.path.isfile(self.journal_path):
+			file = open(self.journal_path, 'r+b')
+			size = 0
+			for line in file:
+				if line[-1:] != '\n':
+					file.truncate(size)
+					break
+				fields = line[:-1].split('\t')
+				meta, values = self.__split(fields[1:])
+				self.new[fields[0]]		= self.decode(values)
+				self.meta[fields[0]]	= meta
+				self.journaled = self.journaled + 1
+				size = size + len(line)
+			file.close()
+
+	def __read_size(self):
+		"""
+		Returns number of entries and bytes of index file; the
+		index is counted only if size file is missing or out
+		of date.
+		"""
+		bytes = os.path.getsize(self.path)
+		try:
+			entries, saved = map(int, open(self.size_path, 'r').read().split())
+			if saved == bytes:
+				return entries, bytes
+		except (IOError, ValueError):
+			pass
+
+		entries, bytes = self.index.size()
+		if not self.readonly:
+			self.__write_size(entries, bytes)
+		return entries, bytes
+
+	def __write_size(self, entries, bytes):
+		file = open(self.size_path, 'w')
+		file.write('%d %d\n' % (entries, bytes))
+		file.close()
+
+	def __compact_due(self, records):
+		"""True if that many records should be merged into index"""
+		return records >= max(self.compact_limit, self.indexed[0] / 2)
+
+	def __use(self, key, meta):
+		count, stamp = meta
+		self.meta[key] = (count + 1, int(self.clock()))
+
+	def __getitem__(self, key):
+		if not self.loaded:
+			self.__load()
+
+		try:
+			value = self.new[key]
+			self.hits = self.hits + 1
+			if self.bounded:
+				self.__use(key, self.meta.get(key, (0, 0)))
+			return value
+		except KeyError:
+			pass
+
+		if self.index != None:
+			fields = self.index.lookup(key)
+			if fields != None:
+				self.hits = self.hits + 1
+				meta, values = self.__split(fields)
+				value = self.decode(values)
+				if self.bounded:
+					# keep entry in memory to remember its use
+					self.new[key] = value
+					self.touched[key] = True
+					self.__use(key, meta)
+					if self.__compact_due(len(self.new)) and not self.readonly:
+						self.compact()
+				return value
+
+		self.misses = self.misses + 1
+		raise KeyError(key)
+	
+	def __setitem__(self, key, value):
+		if not self.loaded:
+			self.__load()
+		self.new[key] = value
+		self.__use(key, self.meta.get(key, (0, 0)))
+		if self.touched.has_key(key):
+			del self.touched[key]
+
+		if self.journal_path == None or self.readonly:
+			return
+
+		self.__write_journal(key, value)
+		if self.__compact_due(self.journaled):
+			self.compact()
+
+	def __write_journal(self, key, value):
+		if self.journal == None:
+			self.journal = open(self.journal_path, 'ab')
+		self.journal.write('\t'.join([key] + self.__fields(key, value)) + '\n')
+		self.journal.flush()
+		self.journaled = self.journaled + 1
+
+	def has_key(self, key):
+		try:
+			self[key]
+			return True
+		except KeyError:
+			return False
+
+	__contains__ = has_key
+
+	def learned(self):
+		"""
+		returns dictionary of entries added in this session
+		and not returned by previous call
+		"""
+		result = {}
+		for key, value in self.new.iteritems():
+			if not self.touched.has_key(key) and not self.reported.has_key(key):
+				result[key] = value
+				self.reported[key] = True
+		return result
+
+	def merge(self, entries):
+		"""add entries (dictionary) not present in cache"""
+		if not self.loaded:
+			self.__load()
+
+		for key, value in entries.iteritems():
+			if self.new.has_key(key):
+				continue
+			if self.index != None and self.index.lookup(key) != None:
+				continue
+			self[key] = value
+
+	def stats(self):
+		"""returns dictionary of hit/miss/eviction counters"""
+		return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+	def __merged(self):
+		new = [(key, self.__fields(key, value)) for key, value in self.new.iteritems()]
+		new.sort()
+		if self.index != None:
+			return merge_items(self.index.items(), new)
+		else:
+			return new
+
+	def __score(self, fields):
+		(count, stamp), _ = self.__split(fields)
+		if self.policy == 'lfu':
+			return (count, stamp)
+		else:
+			return (stamp, count)
+
+	def __bounded(self, items):
+		"""
+		Generator filters merged items (generator function)
+		leaving the best ones that fit in limits.
+		"""
+		# first pass: find score of the worst entry that fits
+		scores = []
+		for key, fields in items():
+			size = len(key) + len(fields) + sum([len(f) for f in fields])
+			scores.append( (self.__score(fields), size) )
+		scores.sort()
+		scores.reverse()
+
+		entries = bytes = 0
+		for score, size in scores:
+			if self.max_entries != None and entries + 1 > self.max_entries:
+				break
+			if self.max_bytes != None and bytes + size > self.max_bytes:
+				break
+			entries	= entries + 1
+			bytes	= bytes + size
+
+		self.evictions = self.evictions + len(scores) - entries
+		if entries == 0:
+			return
+		if entries == len(scores):
+			for item in items():
+				yield item
+			return
+
+		worst = scores[entries-1][0]
+		equal = len([1 for score, _ in scores[:entries] if score == worst])
+		del scores
+
+		# second pass
+		for key, fields in items():
+			score = self.__score(fields)
+			if score > worst:
+				yield (key, fields)
+			elif score == worst and equal > 0:
+				equal = equal - 1
+				yield (key, fields)
+
+	def __over_limits(self):
+		"""
+		True if cache may not fit in limits. New entries that
+		are also in index file (touched) are not counted twice,
+		other updated entries are, so it's an upper bound.
+		"""
+		entries, bytes = self.indexed
+		for key, value in self.new.iteritems():
+			if self.touched.has_key(key):
+				continue
+			fields	= self.__fields(key, value)
+			entries	= entries + 1
+			bytes	= bytes + len(key) + len(fields) + sum([len(f) for f in fields])
+
+		if self.max_entries != None and entries > self.max_entries:
+			return True
+		if self.max_bytes != None and bytes > self.max_bytes:
+			return True
+		return False
+
+	def compact(self):
+		"""
+		Merge new entries into index file, evict entries
+		exceeding limits and truncate journal.
+		"""
+		if not self.loaded:
+			self.__load()
+		if self.path == None or self.readonly or not (self.new or self.bounded):
+			return
+
+		if self.bounded:
+			entries = write_index(self.path, self.__bounded(self.__merged))
+		else:
+			entries = write_index(self.path, self.__merged())
+		self.indexed = (entries, os.path.getsize(self.path))
+		self.__write_size(*self.indexed)
+
+		if self.journal != None:
+			self.journal.close()
+			self.journal = None
+		if os.path.exists(self.journal_path):
+			open(self.journal_path, 'wb').close()
+
+		self.new	= {}
+		self.meta	= {}
+		self.touched	= {}
+		self.index	= SortedIndex(self.path)
+		self.journaled	= 0
+		self.convert	= False
+
+	def save(self, path=None):
+		"""
+		Make cache persistent. New entries are already in the
+		journal, so only an old format cache, a big journal or
+		exceeded limits cause rewriting of the index file. If path
+		is given whole cache is written there.
+		"""
+		if not self.loaded:
+			if path == None or path == self.path:
+				return	# cache wasn't used, there is nothing new
+			self.__load()
+
+		if path != None and path != self.path:
+			write_index(path, self.__merged())
+			return
+
+		if self.readonly:
+			return
+
+		over = self.bounded and self.path != None and self.__over_limits()
+
+		if self.path != None:
+			# remember use of saved entries
+			for key in self.touched.keys():
+				self.__write_journal(key, self.new[key])
+			self.touched = {}
+
+		if self.convert or over or self.__compact_due(self.journaled):
+			self.compact()
+		elif self.journal != None:
+			self.journal.close()
+			self.journal = None
+
+class CheckCache(DiskCache):
+	"""Cache of speller.check() results"""
+	def encode(self, value):
+		if value:
+			return ['1']
+		else:
+			return ['0']
+
+	def decode(self, values):
+		return values == ['1']
+
+class ReplaceCache(DiskCache):
+	"""Cache of words replaced by user (word -> replacement)"""
+	def encode(self, value):
+		return [value]
+
+	def decode(self, values):
+		return values[0]
+
+def merge_items(old, new):
+	"""
+	Generator merges two sorted sequences of pairs (key, values);
+	if key is present in both of them, pair from new is taken.
+	"""
+	new = iter(new)
+	try:
+		item = new.next()
+	except StopIteration:
+		item = None
+
+	for key, values in old:
+		while item != None and item[0] < key:
+			yield item
+			try:
+				item = new.next()
+			except StopIteration:
+				item = None
+
+		if item != None and item[0] == key:
+			continue
+		yield (key, values)
+
+	while item != None:
+		yield item
+		try:
+			item = new.next()
+		except StopIteration:
+			item = None
+
+
+class Speller:
+	"""
+	Speller wrapper. Provides cache for both check() and suggest() methods.
+	Wrapped speller (backend) is any object with methods check() and
+	suggest(), e.g. aspell.Speller or WordListSpeller (see BACKENDS).
+	"""
+
+	def __init__(self, speller, dict_cache=None, sugg_cache=None, cache_options=None):
+		"""
+		cache_options - optional dictionary of DiskCache keyword
+		                arguments (size limits, readonly)
+		"""
+		if cache_options == None:
+			cache_options = {}
+		self.speller = speller
+		self.dict = CheckCache(dict_cache, **cache_options)
+		self.sugg = DiskCache(sugg_cache, **cache_options)
+			
+	def save_dict(self, file=None):
+		self.dict.save(file)
+	
+	def save_sugg(self, file=None):
+		self.sugg.save(file)
+
+	def check(self, word):
+		lword = word.lower()
+		try:
+			return self.dict[lword]
+		except KeyError:
+			result = self.dict[lword] = self.speller.check(lword)
+			return result
+	
+	def suggest(self, word):
+		lword = word.lower()
+		try:
+			return self.sugg[lword]
+		except KeyError:
+			result = self.sugg[lword] = self.speller.suggest(lword)
+			return result
+
+class PolishSpeller:
+	def __init__(self, speller, sugg_cache=None, words=None, index=None, cache_options=None, ngrams=None, freq=None, bigrams=None):
+		"""
+		words - optional WordList; if given possible polish words
+		        are looked up in the list instead of the speller
+		        (its answers are not saved in sugg_cache)
+		index - optional SortedIndex made by build_plindex; if
+		        given suggestions are read directly from it
+		cache_options - optional dictionary of DiskCache keyword
+		        arguments
+		ngrams - optional NgramModel made by build_ngrams; if
+		        given only words having known n-grams are checked
+		        by the speller
+		freq  - optional FrequencyIndex made by build_freq; if
+		        given suggestions are sorted by frequency
+		bigrams - optional FrequencyIndex made by build_bigrams;
+		        if given neighbouring words choose suggestion
+		"""
+		if cache_options == None:
+			cache_options = {}
+		if words != None:
+			sugg_cache = None	# answers of list can't be mixed with speller's ones
+		self.speller	= speller
+		self.words	= words
+		self.index	= index
+		self.ngrams	= ngrams
+		self.freq	= freq
+		self.bigrams	= bigrams
+		self.sugg	= DiskCache(sugg_cache, **cache_options)
+		self.repl	= {}
+	
+	def save_sugg(self, file=None):
+		self.sugg.save(file)
+
+	def __suggest(self, word):
+		lword = word.lower()
+		if self.words != None:
+			result = list(self.words.walk(plword_alternatives(lword)))
+		else:
+			word_list = possible_plwords(lword, self.ngrams)
+			result = [word for word in word_list if self.speller.check(word)]
+
+		self.sugg[lword] = result
+		return result
+
+	def __lookup(self, lword):
+		forms = self.index.lookup(deaccent(lword))
+		if forms == None:
+			return []
+
+		# polish characters already present in word must be kept
+		if lword != deaccent(lword):
+			def match(form):
+				for i in xrange(len(lword)):
+					if lword[i] in pl_letters and lword[i] != form[i]:
+						return False
+				return True
+			forms = [form for form in forms if match(form)]
+
+		return forms
+
+	def suggest_many(self, words):
+		"""
+		Returns dictionary mapping each of words to its suggestions.
+		Words are resolved in sorted order, so saved caches and
+		index are read sequentially.
+		"""
+		words = list(words)
+		words.sort()
+
+		result = {}
+		for word in words:
+			result[word] = self.suggest(word)
+		return result
+
+	def add_replacement(self, word, replacement):
+		self.repl[word] = [replacement]
+	
+	def clear_replacement(self):
+		self.repl = {}
+
+	def rank(self, forms):
+		"""Returns forms sorted by frequency, most frequent first"""
+		if self.freq == None or len(forms) < 2:
+			return forms
+
+		tmp = [(-self.freq.count(form), i, form) for i, form in enumerate(forms)]
+		tmp.sort()
+		return [form for _, _, form in tmp]
+
+	def dominant(self, forms, threshold):
+		"""
+		Returns form which frequency is at least threshold (0..1)
+		of total frequency of all forms; None if there is no such
+		form or frequencies are unknown.
+		"""
+		if self.freq == None or len(forms) == 0:
+			return None
+
+		counts	= [self.freq.count(form) for form in forms]
+		total	= sum(counts)
+		best	= max(counts)
+		if total > 0 and best >= threshold * total:
+			return forms[counts.index(best)]
+		else:
+			return None
+
+	def disambiguate(self, forms, prev, next, threshold):
+		"""
+		Returns form which occurs with neighbouring words prev and
+		next (None if there is no word) in at least threshold (0..1)
+		of all cases; None if there is no such form or pairs are
+		unknown. Neighbours are compared without polish diacritical
+		characters (see build_bigrams).
+		"""
+		if self.bigrams == None or (prev == None and next == None):
+			return None
+
+		counts = []
+		for form in forms:
+			n = 0
+			if prev != None:
+				n = n + self.bigrams.count(deaccent(prev), form, '<')
+			if next != None:
+				n = n + self.bigrams.count(form, deaccent(next), '>')
+			counts.append(n)
+
+		total	= sum(counts)
+		best	= max(counts)
+		if total > 0 and best >= threshold * total:
+			return forms[counts.index(best)]
+		else:
+			return None
+
+	def suggest(self, word):
+		if self.repl.has_key(word):
+			return self.repl[word]
+
+		lword = word.lower()
+		if self.index != None:
+			return self.rank(self.__lookup(lword))
+
+		try:
+			return self.rank(self.sugg[lword])
+		except KeyError:
+			return self.rank(self.__suggest(lword))
+
+
+class RemotePolishSpeller(PolishSpeller):
+	"""
+	PolishSpeller which gets suggestions from SpellServer; frequencies
+	and bigrams (if given) are used locally.
+	"""
+	def __init__(self, client, freq=None, bigrams=None):
+		PolishSpeller.__init__(self, None, None, freq=freq, bigrams=bigrams)
+		self.client = client
+
+	def suggest(self, word):
+		if self.repl.has_key(word):
+			return self.repl[word]
+
+		lword = word.lower()
+		try:
+			return self.rank(self.sugg[lword])
+		except KeyError:
+			result = self.sugg[lword] = self.client.plsuggest(lword)
+			return self.rank(result)
+
+	def suggest_many(self, words):
+		"""Words not known yet are sent to server at once"""
+		unknown = {}
+		for word in words:
+			lword = word.lower()
+			if not self.repl.has_key(word) and not self.sugg.has_key(lword):
+				unknown[lword] = True
+
+		unknown = unknown.keys()
+		for lword, result in zip(unknown, self.client.plsuggest_many(unknown)):
+			self.sugg[lword] = result
+
+		return PolishSpeller.suggest_many(self, words)
+
+class SpellService:
+	"""
+	Answers requests sent to SpellServer, one per line:
+
+		check WORD		-- answer: 1 or 0
+		suggest WORD		-- answer: suggestions of speller
+		plsuggest WORD		-- answer: possible polish words
+		correct TEXT		-- answer: corrected TEXT (one line)
+
+	Answer is a line "OK data" or "ERR message"; lists are
+	separated with tabs.
+	"""
+	def __init__(self, corrector):
+		self.corrector	= corrector
+		self.speller	= corrector.speller
+		self.pl_speller	= corrector.pl_speller
+
+	def correct_lines(self, texts):
+		"""Returns corrected lines of text"""
+		lines = [self.corrector.split(text) for text in texts]
+		self.corrector.correct_lines(lines)
+		return [str(line) for line in lines]
+
+	def answer(self, line):
+		"""Returns answer to request"""
+		return self.answer_many([line])[0]
+
+	def answer_many(self, lines):
+		"""
+		Returns list of answers to requests. Lookups are made
+		in batches: identical words are resolved once, polish
+		suggestions of all requests and words of all texts are
+		resolved together (see PolishSpeller.suggest_many).
+		"""
+		requests = []
+		for line in lines:
+			if ' ' in line:
+				requests.append( tuple(line.split(' ', 1)) )
+			else:
+				requests.append( (line, '') )
+
+		plwords = {}
+		texts	= []
+		for command, argument in requests:
+			if command == 'plsuggest':
+				plwords[argument] = True
+			elif command == 'correct':
+				texts.append(argument)
+
+		try:
+			table = self.pl_speller.suggest_many(plwords.keys())
+		except Exception:
+			table = {}	# errors are reported for each request
+
+		try:
+			corrected = self.correct_lines(texts)
+		except Exception:
+			corrected = [None] * len(texts)
+		corrected.reverse()
+
+		answers = []
+		for command, argument in requests:
+			try:
+				if command == 'check':
+					if self.speller.check(argument):
+						data = '1'
+					else:
+						data = '0'
+				elif command == 'suggest':
+					data = '\t'.join(self.speller.suggest(argument))
+				elif command == 'plsuggest':
+					if table.has_key(argument):
+						data = '\t'.join(table[argument])
+					else:
+						data = '\t'.join(self.pl_speller.suggest(argument))
+				elif command == 'correct':
+					data = corrected.pop()
+					if data == None:
+						data = self.correct_lines([argument])[0]
+				else:
+					answers.append('ERR unknown command %s' % command)
+					continue
+			except Exception:
+				e = sys.exc_info()
+				answers.append('ERR %s: %s' % (str(e[0]), str(e[1])))
+				continue
+
+			answers.append('OK ' + data)
+
+		return answers
+
+def define_server():
+	"""
+	Defines classes SpellChannel and SpellServer; asyncore and
+	asynchat are imported only if the server is started.
+	"""
+	global SpellChannel, SpellServer
+	import asyncore, asynchat
+
+	class SpellChannel(asynchat.async_chat):
+		"""Connection with a client; reads requests line by line"""
+		def __init__(self, sock, server):
+			asynchat.async_chat.__init__(self, sock)
+			self.server	= server
+			self.buffer	= []
+			self.set_terminator('\n')
+
+		def collect_incoming_data(self, data):
+			self.buffer.append(data)
+
+		def found_terminator(self):
+			line = ''.join(self.buffer)
+			self.buffer = []
+			self.server.pending.append( (self, line) )
+
+	class SpellServer(asyncore.dispatcher):
+		"""
+		Long-lived server owning speller objects and their caches
+		(see SpellService). Clients (see SpellClient) connect to
+		a Unix socket.
+
+		Many clients are served at once: requests read from all
+		connections in one pass of the event loop are answered
+		together, so pending lookups of concurrent clients are
+		coalesced and batched instead of being made one by one.
+		"""
+		def __init__(self, path, service):
+			import socket
+			asyncore.dispatcher.__init__(self)
+			if os.path.exists(path):
+				self.remove_stale(path)
+			self.create_socket(socket.AF_UNIX, socket.SOCK_STREAM)
+			self.bind(path)
+			self.listen(16)
+
+			self.path		= path
+			self.service	= service
+			self.pending	= []	# pairs (channel, request)
+
+		def remove_stale(self, path):
+			"""
+			Removes socket left by a server which is not running;
+			raises IOError if path is not a socket or the server
+			still answers.
+			"""
+			import socket, stat
+			if not stat.S_ISSOCK(os.stat(path).st_mode):
+				raise IOError("'%s' exists and is not a socket" % path)
+
+			sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+			try:
+				try:
+					sock.connect(path)
+				except socket.error:
+					os.unlink(path)	# stale socket of previous server
+					return
+			finally:
+				sock.close()
+
+			raise IOError("Server is already running on '%s'" % path)
+
+		def handle_accept(self):
+			pair = self.accept()
+			if pair != None:
+				SpellChannel(pair[0], self)
+
+		def process(self):
+			"""Answers all pending requests"""
+			pending, self.pending = self.pending, []
+			answers = self.service.answer_many([line for _, line in pending])
+			for (channel, _), answer in zip(pending, answers):
+				if channel.connected:
+					channel.push(answer + '\n')
+
+		def serve_forever(self, timeout=1.0):
+			while True:
+				asyncore.loop(timeout, count=1)
+				if self.pending:
+					self.process()
+
+		def server_close(self):
+			asyncore.close_all()
+			if os.path.exists(self.path):
+				os.unlink(self.path)
+
+class SpellClient:
+	"""
+	Client of SpellServer. Provides check() and suggest() methods,
+	thus may be used instead of aspell.Speller (see Speller).
+	"""
+	def __init__(self, path):
+		import socket
+		self.socket	= socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		self.socket.connect(path)
+		self.input	= self.socket.makefile('rb')
+		self.output	= self.socket.makefile('wb')
+
+	def request(self, command, argument):
+		"""Sends request, returns data of answer"""
+		return self.request_many(command, [argument])[0]
+
+	def request_many(self, command, arguments):
+		"""
+		Sends requests at once (server answers them in one batch),
+		returns list of data of answers. Request is a line, thus
+		arguments can't contain newlines.
+		"""
+		for argument in arguments:
+			if '\n' in argument:
+				raise ValueError('Newline in argument of request')
+
+		self.output.write(''.join(['%s %s\n' % (command, argument) for argument in arguments]))
+		self.output.flush()
+
+		result = []
+		for argument in arguments:
+			answer = self.input.readline()
+			if not answer:
+				raise IOError('Connection closed by server')
+
+			answer = answer.rstrip('\n')
+			if answer[:3] == 'OK ':
+				result.append(answer[3:])
+			else:
+				raise RuntimeError(answer[4:])
+
+		return result
+
+	def split(self, data):
+		if data:
+			return data.split('\t')
+		else:
+			return []
+
+	def check(self, word):
+		return self.request('check', word) == '1'
+
+	def suggest(self, word):
+		return self.split(self.request('suggest', word))
+
+	def plsuggest(self, word):
+		return self.split(self.request('plsuggest', word))
+
+	def plsuggest_many(self, words):
+		return [self.split(data) for data in self.request_many('plsuggest', words)]
+
+	def correct(self, text):
+		"""Returns corrected text; lines are sent as separate requests"""
+		return '\n'.join(self.request_many('correct', text.split('\n')))
+
+	def close(self):
+		self.output.close()
+		self.input.close()
+		self.socket.close()
+
+
+VERSION = "$Revision: 1.2 $"
+
+def fileok(filename):
+	"""Check if we can try to check file"""
+	if not os.path.exists(filename): # dosn't exist
+		Info("Plik '%s' nie istnieje." % filename)
+		return False
+	if not os.path.isfile(filename): # is not file
+		Info("'%s' nie jest plikiem." % filename)
+		return False
+	elif os.path.getsize(filename) == 0:
+		Info("Plik '%s' jest pusty." % filename)
+		return False
+	else:
+		return True
+
+def Question(prompt, options, default=None, propagate_break=True):
+	"""
+	prompt  - string
+	options - list of tuples:
+	           1. value
+	           2. string or list of strings assinged to value
+	              first string is displaying
+	default_value	- value returned on press Enter
+	propagate_break	- Ctrl-C is propagate to caller
+	"""
+
+	values = {}
+	opt = []
+	df  = None
+	for value, item in options:
+		if isinstance(item, types.StringType):
+			item = [item]
+
+		if not isinstance(item, (types.ListType, types.TupleType)):
+			raise TypeError("list or tuple is required")
+
+		if df == None and value == default:
+			if len(item[0]) == 1:
+				opt.append(item[0].upper())
+			else:
+				opt.append(item[0])
+		else:
 			if len(item[0]) == 1:
 				opt.append(item[0].lower())
 			else:
@@ -1082,6 +2841,21 @@ def tmpfilename(path, name, postfix=''):
 		if not exists(name):
 			return name
 
+def ReplaceFile(filename, tmpname):
+	"""
+	Replaces file with tmpname; previous contents of file is
+	kept in file named filename + '~'. On error file is restored
+	and OSError raised.
+	"""
+	if os.path.exists(filename+'~'):
+		os.unlink(filename+'~')
+	os.rename(filename, filename+'~')
+	try:
+		os.rename(tmpname, filename)
+	except OSError:
+		os.rename(filename+'~', filename)
+		raise
+
 REPLACE			= 1
 REPLACE_USER	= 2
 REPLACE_ALL		= 3
@@ -1312,23 +3086,119 @@ def ProgressBar(current_val, min_val, max_val, mode=1):
 class AbortProgram:
 	pass
 
-def CheckFile():
-	global replace_list, ignore_list
-	interactive		= options['interactive']
+def neighbours(line, index):
+	"""
+	Returns pair of lower case words preceding and following
+	field index of line (RAW object); whitespaces and punctuation
+	are skipped, dead fields break context. None means there
+	is no such word.
+	"""
+	texts	= line.texts
+	types	= line.types
+	words	= ('check', '__other__')
+	result	= []
+	for fields in (xrange(index-1, -1, -1), xrange(index+1, len(types))):
+		word = None
+		for i in fields:
+			if types[i] in words:
+				word = texts[i].lower()
+				break
+			elif types[i] == '__fixed__':
+				break
+		result.append(word)
 
-	for line_number in xrange(len(File)):
+	return result
 
-		if not interactive and not options['quiet']:
-			ProgressBar(line_number, 0, len(File))
+# matches whitespaces (first stage of line split)
+re_whitespaces	= re.compile(r'\s+')
+# matches punctuators (second stage of line split)
+re_punctuators	= re.compile(r'[,.?!:;\'"<>(){}\[\]$%^&@~|\\/*+-]+')
+# marks all words containing letters (option -a)
+re_all_words	= re.compile(r'^[ʣӦA-Za-z]+$')
+# marks words containing letters but without polish letters (default)
+re_latin_words	= re.compile(r'^[A-Za-z]+$')
 
-		File.edit(line_number)
-		
-		more_options = []
+class Corrector:
+	"""
+	Corrects text without user's interaction: words having only
+	one possible polish form (or a dominant one, see PolishSpeller)
+	are replaced, others are left intact.
+
+	Corrector keeps no state between calls except caches of
+	spellers, so one object may correct any number of texts.
+	Options are given as dictionary (see Corrector.defaults).
+	"""
+	defaults = {
+		'ignore_shorter_then'	: 2,		# don't check shorter words
+		'checkall'				: False,	# check also words with polish letters
+		'spellchecker'			: False,	# check spelling of other words
+		'threshold'				: 0.9,		# see PolishSpeller.dominant
+		'quiet'					: True,		# don't show progress
+	}
+
+	# longer words have too many possible polish forms,
+	# they are only checked by speller
+	max_plword_length = 10
+
+	def __init__(self, speller, pl_speller, options=None, replace_list=None, ignore_list=None):
+		"""
+		replace_list - maps word to its replacement
+		ignore_list  - words that are left intact
+		"""
+		self.speller	= speller
+		self.pl_speller	= pl_speller
+
+		self.options = dict(self.defaults)
+		if options:
+			for key in self.defaults:
+				if options.has_key(key):
+					self.options[key] = options[key]
+
+		if replace_list == None:
+			replace_list = {}
+		if ignore_list == None:
+			ignore_list = {}
+		self.replace_list	= replace_list
+		self.ignore_list	= ignore_list
+
+		if self.options['checkall']:
+			mark = re_all_words
+		else:
+			mark = re_latin_words
+		self.editor = SpellerEditor(None, re_whitespaces, 'W', re_punctuators, 'P', mark, 'check')
+
+	def split(self, line, ranges=None):
+		"""Returns RAW object of line; ranges are dead fields"""
+		return self.editor.split(line, ranges)
+
+	def is_plword(self, substring, type):
+		"""
+		True if word is looked up in polish speller: marked word
+		neither too short nor too long, not present in ignore
+		and replace lists.
+		"""
+		return type == 'check' \
+			and self.options['ignore_shorter_then'] <= len(substring) <= self.max_plword_length \
+			and not self.ignore_list.has_key(substring) \
+			and not self.replace_list.has_key(substring)
+
+	def correct_line(self, line, table=None):
+		"""
+		Makes automatic replacements in line (RAW object).
+		Returns list of indexes of fields which need user's decision.
+		Table (optional) maps lower case words to polish suggestions
+		resolved earlier.
+		"""
+		options			= self.options
+		speller			= self.speller
+		pl_speller		= self.pl_speller
+		replace_list	= self.replace_list
+		ignore_list		= self.ignore_list
+		more_options	= []
 
 		# automatic conversion of single replacement pairs
-		n = len(File[line_number])
 		w = '|/-\\'
-		for index, field in enumerate(File[line_number]):
+		for index, field in enumerate(line):
 			substring, _, type = field
 		
 			if not options['quiet']:
@@ -1343,32 +3213,146 @@ def CheckFile():
 				continue
 
 			if replace_list.has_key(substring):
-				File[line_number][index] = replace_list[substring]
+				line[index] = replace_list[substring]
 				continue
 
 			# if program works like regular speller
 			# check spelling of other words
-			if (options['spellchecker'] and type == '__other__') or (len(substring) > 10 and type == 'check'):
+			if (options['spellchecker'] and type == '__other__') or (len(substring) > self.max_plword_length and type == 'check'):
 				if not speller.check(substring):
 					more_options.append(index)
 				continue
 			
 			# do not check not marked words
-			if type != 'check':
+			if not self.is_plword(substring, type):
 				continue
 			
 			lsubstring	= substring.lower()
-			props		= pl_speller.suggest(substring)
+			if table != None and table.has_key(lsubstring):
+				props	= table[lsubstring]
+			else:
+				props	= pl_speller.suggest(substring)
+
+			if len(props) == 0:
+				if options['spellchecker'] and not speller.check(substring):
+					more_options.append(index)
+				continue
+			elif len(props) == 1:
+				if props[0] != lsubstring:
+					line[index] = clone_case(substring, props[0])
+			else:
+				# form chosen by neighbouring words is taken, otherwise
+				# the most frequent form if it dominates
+				prev, next = neighbours(line, index)
+				form = pl_speller.disambiguate(props, prev, next, options['threshold'])
+				if form == None:
+					form = pl_speller.dominant(props, options['threshold'])
+				if form == None:
+					more_options.append(index)
+				elif form != lsubstring:
+					line[index] = clone_case(substring, form)
+
+		return more_options
+
+	def correct_lines(self, lines):
+		"""
+		Makes automatic replacements in list of lines (RAW objects).
+		All distinct words are resolved first in one pass (see
+		PolishSpeller.suggest_many), then lines are corrected using
+		the table of answers.
+		"""
+		words = {}
+		for line in lines:
+			for substring, _, type in line:
+				if self.is_plword(substring, type):
+					words[substring.lower()] = True
+
+		table = self.pl_speller.suggest_many(words.keys())
+		for line in lines:
+			self.correct_line(line, table)
+
+	def correct_text(self, text, filter=None):
+		"""Returns corrected text (see Filter)"""
+		lines = text.split('\n')
+		if filter:
+			document = filter.process(lines)
+		else:
+			document = [(line, None) for line in lines]
+
+		lines = [self.split(line, ranges) for line, ranges in document]
+		self.correct_lines(lines)
+		return '\n'.join([str(line) for line in lines])
+
+	def correct_words(self, words):
+		"""Returns list of corrected words"""
+		lines = [self.split(word) for word in words]
+		self.correct_lines(lines)
+		return [str(line) for line in lines]
+
+def StreamFile(input, output, corrector, filter=None, size=0, window=0):
+	"""
+	Non-interactive check: lines are read from input, corrected
+	and written to output one by one, so memory usage doesn't
+	depend on file size. Size of input (if known) is used to
+	display progress.
+
+	If window is greater than zero, lines are corrected in groups
+	of that size with Corrector.correct_lines.
+	"""
+	if filter:
+		filter.reset()
+
+	quiet = corrector.options['quiet']
+	pos  = 0
+	last = -1
+	lines = []
+	for line in input:
+		if size and not quiet:
+			pos = pos + len(line)
+			if pos*1000/size != last:
+				last = pos*1000/size
+				ProgressBar(pos, 0, size)
+
+		if line[-1] == os.linesep:
+			line = line[:-1]
+
+		if filter:
+			ranges = filter.process_line(line)
+		else:
+			ranges = None
+
+		tmp = corrector.split(line, ranges)
+		if window > 0:
+			lines.append(tmp)
+			if len(lines) == window:
+				corrector.correct_lines(lines)
+				for tmp in lines:
+					output.write(str(tmp) + os.linesep)
+				lines = []
+		else:
+			corrector.correct_line(tmp)
+			output.write(str(tmp) + os.linesep)
+
+	if lines:
+		corrector.correct_lines(lines)
+		for tmp in lines:
+			output.write(str(tmp) + os.linesep)
+
+	if not quiet:
+		print
+
+def CheckFile():
+	global replace_list, ignore_list
+	interactive		= options['interactive']
 
-			if len(props) == 0:
-				if options['spellchecker'] and not speller.check(substring):
-					more_options.append(index)
-				continue
-			elif len(props) == 1:
-				if props[0] != lsubstring:
-					File[line_number][index] = clone_case(substring, props[0])
-			else:
-				more_options.append(index)
+	w = '|/-\\'
+	for line_number in xrange(len(File)):
+
+		if not interactive and not options['quiet']:
+			ProgressBar(line_number, 0, len(File))
+
+		File.edit(line_number)
+		more_options = corrector.correct_line(File[line_number])
 			
 		if (len(more_options) == 0) or not interactive:
 			File.save(line_number)
@@ -1440,13 +3424,21 @@ def CheckFile():
 
 HELP = """%s [opcje] PLIKI
 
+Jeli nazw pliku jest '-', to poprawiane jest standardowe wejcie,
+a wynik wypisywany na standardowe wyjcie.
+
 -h, --help      pomoc
 
 -v, --version   wersja programu
 
 -n              tryb nieinteraktywny
 
--H,--html       przetwarzanie pliku HTML
+-H,--html       przetwarzanie pliku HTML (to samo co -f html)
+
+-f,--filter NAZWA
+                format pliku: html, markdown, latex, rest albo text
+                (zwyky tekst); domylnie format jest rozpoznawany
+                po rozszerzeniu nazwy pliku
 
 -q,--quiet      program nie wypisuje nic na ekranie
                 uycie tej opcji implikuje tryb nieinteraktywny
@@ -1458,14 +3450,70 @@ HELP = """%s [opcje] PLIKI
 				
 -d              pyta o pisowni w przypadku, gdy nie udao si
                 znale podobnych sw w sowniku
+
+-w,--words PLIK lista sw (jedno lub wicej w linii), w ktrej
+                wyszukiwane s polskie sowa zamiast w aspellu;
+                '-' oznacza standardowe wejcie
+
+-b,--backend NAZWA
+                sownik, ktrym sprawdzane s sowa: aspell
+                (domylnie) albo words (lista sw z opcji -w,
+                nie wymaga moduu aspell-python)
+
+--build-index PLIK
+                buduje z listy sw indeks polskich sw, ktry
+                zastpuje odpytywanie aspella
+
+--build-ngrams PLIK
+                uczy si z tekstu (korpusu) polskich n-gramw,
+                dziki ktrym aspell sprawdza mniej moliwych sw
+
+--build-freq PLIK
+                zlicza wystpienia sw w tekcie (korpusie);
+                podpowiedzi s potem sortowane wedug czstoci
+
+--threshold P   jeli najczstsza z kilku podpowiedzi stanowi co
+                najmniej P (domylnie 0.9) wystpie wszystkich,
+                to jest wybierana bez pytania
+
+--build-bigrams PLIK
+                zlicza w tekcie (korpusie) pary ssiednich sw;
+                spord kilku podpowiedzi wybierana jest potem ta,
+                ktra pasuje do ssiednich sw
+
+--cache-entries N, --cache-bytes N
+                ograniczenie liczby wpisw albo rozmiaru kadego
+                z plikw pamici podrcznej
+
+--cache-policy lru|lfu
+                ktre wpisy s usuwane po przekroczeniu ogranicze:
+                najdawniej (lru, domylnie) albo najrzadziej (lfu)
+                uywane
+
+-j,--jobs N     liczba procesw sprawdzajcych jednoczenie pliki
+                w trybie nieinteraktywnym
+
+--server GNIAZDO
+                uruchamia serwer, ktry sprawdza sowa na zlecenie
+                innych wywoa programu (z opcj --connect);
+                zachowuje aspella i pami podrczn midzy nimi
+
+--connect GNIAZDO
+                sowa s sprawdzane przez serwer, zamiast przez
+                aspella uruchamianego przy kadym wywoaniu
+
+-m,--memorize   sowa zamieniane i ignorowane w trybie interaktywnym
+                s zapamitywane na stae, a nie tylko do koca
+                sprawdzania pliku
+
+--two-pass      w trybie nieinteraktywnym najpierw zbierane s
+                wszystkie rne sowa z kolejnych 10000 linii,
+                a dopiero potem poprawiany jest tekst
 """
 
 if __name__ == "__main__":
-	import os
 	import os.path
 	import sys
-	import re
-	import types
 
 	###
 	### Parse program arguments
@@ -1496,6 +3544,26 @@ if __name__ == "__main__":
 	# cache for polish_speller.suggest() results
 	options['cache_pl_suggestions'] = 'plsugg'
 
+	# index of polish words (see build_plindex)
+	options['cache_pl_index'] = 'plindex'
+
+	# n-grams of polish words (see build_ngrams)
+	options['cache_pl_ngrams'] = 'plngrams'
+
+	# words replaced and ignored by user (see option -m)
+	options['cache_replace']	= 'replace'
+	options['cache_ignore']		= 'ignore'
+
+	# frequencies of polish words (see build_freq)
+	options['cache_pl_freq'] = 'plfreq'
+
+	# pairs of adjacent words (see build_bigrams)
+	options['cache_pl_bigrams'] = 'plbigrams'
+
+	# dominant form of word is chosen without asking (see
+	# PolishSpeller.dominant)
+	options['threshold']	= 0.9
+
 	# ignore words shorter (relation < ) then given value
 	options['ignore_shorter_then'] = 2
 
@@ -1507,10 +3575,37 @@ if __name__ == "__main__":
 	options['quiet']		= False
 	options['spellchecker']	= False 
 	options['checkall']		= False 
-	options['HTMLfilter']	= False 
+	options['filter']		= None	# see FILTERS; None - by extension
+	options['wordlist']		= None
+	options['backend']		= 'aspell'	# see BACKENDS
+	options['build_index']	= None
+	options['build_ngrams']	= None
+	options['build_freq']	= None
+	options['build_bigrams']	= None
+	options['memorize']		= False
+	options['server']		= None	# path of socket (see SpellServer)
+	options['connect']		= None
+
+	# limits of cache size (None - unlimited) and eviction policy
+	options['cache_limits']	= {}
+
+	# number of worker processes in non-interactive mode
+	options['jobs']			= 1
+
+	# resolve distinct words of each 'window' lines first
+	options['two_pass']		= False
+	options['window']		= 10000
+
+	def argument(index):
+		"Returns value of option at given index"
+		if index + 1 >= len(sys.argv):
+			print HELP % prog
+			sys.exit(1)
+		return sys.argv[index + 1]
 
 	skip = 1
-	for arg in sys.argv[1:]:
+	while skip < len(sys.argv):
+		arg = sys.argv[skip]
 		if arg in ['-h','--help']:
 			print HELP % prog
 			sys.exit(0)
@@ -1532,15 +3627,92 @@ if __name__ == "__main__":
 			options['interactive']	= False
 			skip = skip + 1
 		elif arg in ['-H','--html']:
-			options['HTMLfilter']	= True
+			options['filter']	= 'html'
 			skip = skip + 1
+		elif arg in ['-f','--filter']:
+			name = argument(skip).lower()
+			if name != 'text' and not FILTERS.has_key(name):
+				print HELP % prog
+				sys.exit(1)
+			options['filter']	= name
+			skip = skip + 2
 		elif arg in ['-d']:
 			options['ask_unknown'] = True
 			skip = skip + 1
+		elif arg in ['-w','--words']:
+			options['wordlist'] = argument(skip)
+			skip = skip + 2
+		elif arg in ['-b','--backend']:
+			name = argument(skip).lower()
+			if not BACKENDS.has_key(name):
+				print HELP % prog
+				sys.exit(1)
+			options['backend']	= name
+			skip = skip + 2
+		elif arg == '--build-index':
+			options['build_index'] = argument(skip)
+			skip = skip + 2
+		elif arg == '--build-ngrams':
+			options['build_ngrams'] = argument(skip)
+			skip = skip + 2
+		elif arg == '--build-freq':
+			options['build_freq'] = argument(skip)
+			skip = skip + 2
+		elif arg == '--build-bigrams':
+			options['build_bigrams'] = argument(skip)
+			skip = skip + 2
+		elif arg == '--threshold':
+			try:
+				options['threshold'] = float(argument(skip))
+			except ValueError:
+				print HELP % prog
+				sys.exit(1)
+			skip = skip + 2
+		elif arg in ['--cache-entries', '--cache-bytes']:
+			try:
+				n = int(argument(skip))
+			except ValueError:
+				print HELP % prog
+				sys.exit(1)
+			if arg == '--cache-entries':
+				options['cache_limits']['max_entries'] = n
+			else:
+				options['cache_limits']['max_bytes'] = n
+			skip = skip + 2
+		elif arg in ['-j', '--jobs']:
+			try:
+				options['jobs'] = max(1, int(argument(skip)))
+			except ValueError:
+				print HELP % prog
+				sys.exit(1)
+			skip = skip + 2
+		elif arg == '--server':
+			options['server'] = argument(skip)
+			skip = skip + 2
+		elif arg == '--connect':
+			options['connect'] = argument(skip)
+			skip = skip + 2
+		elif arg in ['-m', '--memorize']:
+			options['memorize'] = True
+			skip = skip + 1
+		elif arg == '--two-pass':
+			options['two_pass'] = True
+			skip = skip + 1
+		elif arg == '--cache-policy':
+			policy = argument(skip).lower()
+			if policy not in ['lru', 'lfu']:
+				print HELP % prog
+				sys.exit(1)
+			options['cache_limits']['policy'] = policy
+			skip = skip + 2
 		else:
 			break
 
 	FileList = sys.argv[skip:]
+
+	if '-' in FileList: # stdout carries text, user can't be asked
+		options['quiet']		= True
+		options['interactive']	= False
 	
 	if not sys.stdout.isatty(): # be quiet if we don't write on tty
 		options['quiet']		= True
@@ -1552,7 +3724,7 @@ if __name__ == "__main__":
 	if options['quiet']:
 		def Die(s):
 			sys.exit(1)
-		def Info(s, n):
+		def Info(string, new_line=True, flush=False):
 			pass
 	else:
 		def Die(string):
@@ -1580,23 +3752,62 @@ if __name__ == "__main__":
 	elif not os.path.isdir(options['cache_path']):
 		Die("'%s' nie jest katalogiem." % options['cache_path'])
 	
-	if len(FileList) == 0:
-		Die("Podaj nazw pliku.")
-	
-	###
-	### Try to import aspell-python module
-	###
-	try:
-		import aspell
-	except:
-		e = sys.exc_info()
-		Die('%s: %s' % (str(e[0]), str(e[1])))
-	
 	try:
 		import locale
 		locale.setlocale(locale.LC_ALL, 'pl_PL')
 	except:
 		Die('Nie mog zmieni ustawi na jzk polski.')
+
+	###
+	### Build index, n-grams or frequencies of polish words and exit
+	###
+	builds = [
+		# option, file, function, description, unit
+		('build_index',  'cache_pl_index',  build_plindex, 'indeksu', 'sw'),
+		('build_ngrams', 'cache_pl_ngrams', build_ngrams,  'n-gramw', 'n-gramw'),
+		('build_freq',   'cache_pl_freq',   build_freq,    'czstoci sw', 'sw'),
+		('build_bigrams', 'cache_pl_bigrams', build_bigrams, 'par sw', 'par sw'),
+	]
+	built = False
+	for option, name, build, description, unit in builds:
+		if not options[option]:
+			continue
+
+		path = options['cache_path'] + os.sep + options[name]
+		Info("Budowanie %s '%s'..." % (description, path), False, True)
+		try:
+			n = build(read_words(options[option]), path)
+		except (IOError, OSError):
+			e = sys.exc_info()
+			Die('%s: %s' % (str(e[0]), str(e[1])))
+		except KeyboardInterrupt:
+			Die("Przerwany")
+		Info("ok, zapisano %d %s" % (n, unit))
+		built = True
+
+	if built:
+		sys.exit(0)
+
+	if len(FileList) == 0 and not options['server']:
+		Die("Podaj nazw pliku.")
+
+	if options['backend'] == 'words' and not options['wordlist'] and not options['connect']:
+		Die("Sownik 'words' wymaga listy sw (opcja -w).")
+	
+	###
+	### Check aspell-python module
+	###
+	if options['connect']:
+		options['jobs'] = 1	# workers would need own spellers
+	elif options['backend'] == 'aspell':
+		# aspell is loaded on first lookup (see LoadBackend),
+		# here only presence of module is checked
+		try:
+			import imp
+			imp.find_module('aspell')
+		except ImportError:
+			e = sys.exc_info()
+			Die('%s: %s' % (str(e[0]), str(e[1])))
 	
 	###
 	### Create speller wrapper and polish-specific speller
@@ -1618,63 +3829,330 @@ if __name__ == "__main__":
 		if options['use_cache']:
 			info  = []
 			path1 = options['cache_path'] + os.sep + options['cache_dictionary']
-			if not os.path.isfile(path1):
-				path1 = None
-			else:
+			if os.path.isfile(path1):
 				info.append('sownika (%s)' % getsize(path1))
 
 			path2 = options['cache_path'] + os.sep + options['cache_suggestions']
-			if not os.path.isfile(path2):
-				path2 = None
-			else:
+			if os.path.isfile(path2):
 				info.append('podpowiedzi (%s)' % getsize(path2))
 			
 			path3 = options['cache_path'] + os.sep + options['cache_pl_suggestions']
-			if not os.path.isfile(path3):
-				path3 = None
-			else:
+			if options['wordlist']:
+				path3 = None	# see PolishSpeller
+			elif os.path.isfile(path3):
 				info.append('polskich podpowiedzi (%s)' % getsize(path3))
+
+			if options['backend'] != 'aspell':
+				# answers of other backends can't be mixed with aspell's
+				# ones, besides a word list is faster than any cache
+				path1 = path2 = path3 = None
+				info  = []
+
+			path4 = options['cache_path'] + os.sep + options['cache_pl_index']
+			if not os.path.isfile(path4):
+				path4 = None
+			else:
+				info.append('indeksu polskich sw (%s)' % getsize(path4))
+
+			path5 = options['cache_path'] + os.sep + options['cache_pl_ngrams']
+			if not os.path.isfile(path5):
+				path5 = None
+			else:
+				info.append('n-gramw (%s)' % getsize(path5))
+
+			path6 = options['cache_path'] + os.sep + options['cache_pl_freq']
+			if not os.path.isfile(path6):
+				path6 = None
+			else:
+				info.append('czstoci sw (%s)' % getsize(path6))
+
+			path7 = options['cache_path'] + os.sep + options['cache_pl_bigrams']
+			if not os.path.isfile(path7):
+				path7 = None
+			else:
+				info.append('par sw (%s)' % getsize(path7))
 		
 			if not options['quiet'] and info:
 				Info("Odtwarzam dane: " + ", ".join(info))
 		else:
-			path1 = path2 = path3 = None
-			
-		speller		= Speller( aspell.Speller('lang', 'pl'), path1, path2)
-		pl_speller	= PolishSpeller(speller, path3)
-		replace_list	= {}
-		ignore_list		= {}
+			path1 = path2 = path3 = path4 = path5 = path6 = path7 = None
+
+		def LoadWordList(filename):
+			"Reads word list on first lookup (see Lazy)"
+			try:
+				return WordList(read_words(filename))
+			except IOError:
+				e = sys.exc_info()
+				Die('%s: %s' % (str(e[0]), str(e[1])))
+
+		if options['wordlist']:
+			if options['wordlist'] != '-' and not os.access(options['wordlist'], os.R_OK):
+				Die("Nie mog odczyta listy sw '%s'." % options['wordlist'])
+			wordlist = Lazy(LoadWordList, options['wordlist'])
+		else:
+			wordlist = None
+
+		def LoadBackend(words):
+			"Creates backend on first lookup (see Lazy)"
+			try:
+				if words != None and options['backend'] == 'words':
+					words = words.load()	# backend uses the list itself
+				return BACKENDS[options['backend']](words)
+			except SystemExit:
+				raise
+			except:
+				e = sys.exc_info()
+				Die('%s: %s' % (str(e[0]), str(e[1])))
+
+		if options['connect']:
+			backend = None
+		else:
+			backend = Lazy(LoadBackend, wordlist)
+
+		if path4:
+			index = SortedIndex(path4)
+		else:
+			index = None
+
+		if path5:
+			ngrams = NgramModel(path5)
+		else:
+			ngrams = None
+
+		if path6:
+			freq = FrequencyIndex(path6)
+		else:
+			freq = None
+
+		if path7:
+			bigrams = FrequencyIndex(path7)
+		else:
+			bigrams = None
+
+		limits		= options['cache_limits']
+		if options['connect']:
+			try:
+				client	= SpellClient(options['connect'])
+			except IOError:
+				e = sys.exc_info()
+				Die("Nie mog poczy si z serwerem '%s': %s" % (options['connect'], str(e[1])))
+			speller		= Speller(client)
+			pl_speller	= RemotePolishSpeller(client, freq, bigrams)
+		else:
+			speller		= Speller(backend, path1, path2, limits)
+			pl_speller	= PolishSpeller(speller, path3, wordlist, index, limits, ngrams, freq, bigrams)
+		if options['memorize']:
+			path = options['cache_path'] + os.sep + options['cache_replace']
+			replace_list	= ReplaceCache(path)
+			path = options['cache_path'] + os.sep + options['cache_ignore']
+			ignore_list		= CheckCache(path)
+		else:
+			replace_list	= {}
+			ignore_list		= {}
 	except KeyboardInterrupt:
 		Die("Przerwany")
 	
 	###
 	### Load file(s)
 	###
+	corrector = Corrector(speller, pl_speller, options, replace_list, ignore_list)
 
-	# matches whitespaces (using on first stage of line split)
-	whitespaces	= re.compile(r'\s+')
-	# matches punctuators (using on second stage of line split)
-	punctuators	= re.compile(r'[,.?!:;\'"<>(){}\[\]$%^&@~|\\/*+-]+')
-	if options['checkall']:
-		# mark all words contains letters
-		probably_pl	= re.compile(r'^[ʣӦA-Za-z]+$')
-	else:
-		# mak wods contains letter but without polish letters (default) 
-		probably_pl	= re.compile(r'^[A-Za-z]+$')
+	###
+	### Serve other instances of program until interrupted
+	###
+	if options['server']:
+		def Terminate(signum, frame):
+			raise KeyboardInterrupt
+
+		import signal
+		signal.signal(signal.SIGTERM, Terminate)
+
+		corrector.options['quiet'] = True	# nothing can be written
+		backend.load()	# fail now, not while serving
+		if wordlist != None:
+			wordlist.load()
+		try:
+			define_server()
+			server = SpellServer(options['server'], SpellService(corrector))
+		except (IOError, OSError):
+			e = sys.exc_info()
+			Die('%s: %s' % (str(e[0]), str(e[1])))
+
+		Info("Serwer czeka na poczenia '%s'..." % options['server'])
+		try:
+			server.serve_forever()
+		except KeyboardInterrupt:
+			pass
+		server.server_close()
+		FileList = []
+
+	###
+	### Check files using worker processes
+	###
+	if options['jobs'] > 1 and not options['interactive']:
+		try:
+			import multiprocessing
+		except ImportError:
+			Info("Brak moduu multiprocessing, pliki bd sprawdzane po kolei.")
+			options['jobs'] = 1
+
+	def InitWorker():
+		"Creates own speller objects in worker process"
+		global backend, speller, pl_speller, corrector
+		options['quiet'] = True
+		cache_options	= dict(options['cache_limits'], readonly=True)
+		if options['backend'] == 'aspell':
+			backend		= Lazy(aspell_backend)	# aspell can't be shared
+		speller			= Speller(backend, path1, path2, cache_options)
+		pl_speller		= PolishSpeller(speller, path3, wordlist, index, cache_options, ngrams, freq, bigrams)
+		corrector		= Corrector(speller, pl_speller, options, replace_list, ignore_list)
+
+	def CheckFileJob(filename):
+		"""
+		Checks file in worker process. Returns filename, error
+		message (None on success) and entries learned by caches.
+		"""
+		filter	= get_filter(options['filter'], filename)
+		error	= None
+		tmpname	= tmpfilename('.', filename+'-')
+		try:
+			file = open(tmpname, 'w')
+			StreamFile(open(filename, 'r'), file, corrector, filter, 0, Window())
+			file.close()
+			ReplaceFile(filename, tmpname)
+		except (IOError, OSError):
+			e = sys.exc_info()
+			error = '%s: %s' % (str(e[0]), str(e[1]))
+
+		return (filename, error, Learned())
+
+	def CheckChunkJob(chunk):
+		"""
+		Corrects lines in worker process; chunk is a list of pairs
+		(line, dead ranges). Returns list of corrected lines and
+		entries learned by caches.
+		"""
+		lines = [corrector.split(line, ranges) for line, ranges in chunk]
+		if options['two_pass']:
+			corrector.correct_lines(lines)
+		else:
+			for tmp in lines:
+				corrector.correct_line(tmp)
+
+		return ([str(tmp) for tmp in lines], Learned())
+
+	def Learned():
+		"Returns entries learned by caches since last call"
+		return [speller.dict.learned(), speller.sugg.learned(), pl_speller.sugg.learned()]
+
+	def Merge(learned):
+		"Merges entries learned by worker into caches"
+		for cache, entries in zip([speller.dict, speller.sugg, pl_speller.sugg], learned):
+			cache.merge(entries)
+
+	def StreamChunks(input, output, filter=None, size=0, chunk_lines=1000):
+		"""
+		Works like StreamFile, but lines are split into chunks
+		corrected by worker processes. Filter is run here, as its
+		state is carried from line to line. Only a few chunks
+		are pending at a time, so memory usage stays flat.
+		"""
+		def lines():
+			for line in input:
+				if line[-1] == os.linesep:
+					line = line[:-1]
+				yield line
+
+		def chunks():
+			if filter:
+				document = filter.process(lines())
+			else:
+				document = ((line, None) for line in lines())
+
+			chunk = []
+			for item in document:
+				chunk.append(item)
+				if len(chunk) == chunk_lines:
+					yield chunk
+					chunk = []
+			if chunk:
+				yield chunk
+
+		pending = []
+		for chunk in chunks():
+			pending.append( pool.apply_async(CheckChunkJob, (chunk,)) )
+			if len(pending) < 2*options['jobs']:
+				continue
+
+			lines, learned = pending.pop(0).get()
+			for line in lines:
+				output.write(line + os.linesep)
+			Merge(learned)
+
+			if size and not options['quiet']:
+				ProgressBar(input.tell(), 0, size)
+
+		while pending:
+			lines, learned = pending.pop(0).get()
+			for line in lines:
+				output.write(line + os.linesep)
+			Merge(learned)
+
+		if size and not options['quiet']:
+			print
+
+	def Window():
+		"Returns window size for StreamFile"
+		if options['two_pass']:
+			return options['window']
+		else:
+			return 0
+
+	def Stream(input, output, filter=None, size=0):
+		"Corrects input to output, in worker processes if there are any"
+		if pool:
+			StreamChunks(input, output, filter, size)
+		else:
+			StreamFile(input, output, corrector, filter, size, Window())
+
+	pool = None
+	if options['jobs'] > 1 and not options['interactive']:
+		if len(FileList) >= options['jobs'] and '-' not in FileList:
+			# many files: each is checked by one worker
+			Jobs = [filename for filename in FileList if fileok(filename)]
+			FileList = []	# nothing left for sequential check
+		else:
+			# few files: lines of each file are spread over workers
+			Jobs = []
+
+		backend.load()	# fail now, not in every worker
+		if wordlist != None:
+			wordlist.load()	# shared with workers
+		pool = multiprocessing.Pool(options['jobs'], InitWorker)
+		try:
+			for n, result in enumerate(pool.imap_unordered(CheckFileJob, Jobs)):
+				filename, error, learned = result
+				if error:
+					Info("Plik '%s' (%d/%d): %s" % (filename, n+1, len(Jobs), error))
+				else:
+					Info("Sprawdzono plik '%s' (%d/%d)" % (filename, n+1, len(Jobs)))
+				Merge(learned)
+		except KeyboardInterrupt:
+			pool.terminate()
+			Die("Przerwany")
 
 	default_answer = None
 	for file_num, filename in enumerate(FileList):
-		if file_num > 0 and default_answer == None:
+		if file_num > 0 and default_answer == None and options['interactive'] and not options['memorize']:
 			tmp = [ ('clear',	['Tak','t']),\
 			        ('leave',	['Nie','n']),\
 					('always',	['Zawsze','z']),\
 					('never',	['niGdy','g']) ]
-			print file_num
 			ans = Question("Skasowa sowa zamieniane lub ignorowane?", tmp, 'always', False)
 			if ans == 'clear':
 				clear = True
 			elif ans == 'leave':
-				clear = True
+				clear = False
 			elif ans == 'always':
 				clear = True
 				default_answer = True
@@ -1687,33 +4165,84 @@ if __name__ == "__main__":
 		if clear or default_answer:
 			replace_list	= {}
 			ignore_list		= {}
+			corrector.replace_list	= replace_list
+			corrector.ignore_list	= ignore_list
 
-		try:
-			Info("Wczytywanie pliku '%s' (%d/%d)..." % (filename, file_num+1, len(FileList)), False)
+		filter = get_filter(options['filter'], filename)
+
+		if filename == '-':
+			###
+			### Filter: stdin is corrected to stdout
+			###
+			try:
+				Stream(sys.stdin, sys.stdout, filter)
+				sys.stdout.flush()
+			except (AbortProgram, KeyboardInterrupt):
+				if pool:
+					pool.terminate()
+				Die("Przerwane")
+			except IOError:
+				e = sys.exc_info()
+				Die('%s: %s' % (str(e[0]), str(e[1])))
+			continue
+
+		if not options['interactive']:
+			###
+			### Stream file: lines are corrected and written at once
+			###
 			if not fileok(filename):
 				continue
 
-			if options['HTMLfilter']:
-				File = SpellerEditor(open(filename, 'r'), whitespaces, 'W', punctuators, 'P', probably_pl, 'check', HTMLFilter())
-			else:
-				File = SpellerEditor(open(filename, 'r'), whitespaces, 'W', punctuators, 'P', probably_pl, 'check')
-		
-			Info("ok, wczytano %d linii (%s)" % (len(File), getsize(filename)))
+			Info("Sprawdzanie pliku '%s' (%d/%d)..." % (filename, file_num+1, len(FileList)))
+			tmpname = tmpfilename('.', filename+'-')
+			try:
+				input	= open(filename, 'r')
+				file	= open(tmpname, 'w')
+			except IOError:
+				e = sys.exc_info()
+				Die('%s: %s' % (str(e[0]), str(e[1])))
 
-		except KeyboardInterrupt:
-			if QuestionYesNo('Przerwa przetwarzanie plikw', False, False):
-				Die("Przerwany")
-		except IOError:
-			e = sys.exc_info()
-			Info('%s: %s' % (str(e[0]), str(e[1])))
+			try:
+				Stream(input, file, filter, os.path.getsize(filename))
+				file.close()
+			except (AbortProgram, KeyboardInterrupt):
+				file.close()
+				os.unlink(tmpname)
+				if pool:
+					pool.terminate()
+					Die("Przerwane")
+				if QuestionYesNo('Zakoczy program', False, False):
+					Die("Przerwane")
+				continue
+			except (IOError, OSError):
+				e = sys.exc_info()
+				Die('%s: %s' % (str(e[0]), str(e[1])))
 
-		try:
-			Terminal.settitle("Sprawdzanie pliku '%s'" % filename)
-			CheckFile()
-		except (AbortProgram, KeyboardInterrupt):
-			if QuestionYesNo('Zakoczy program bez zapisywania pamici podrcznej', False, False):
-				Die("Przerwane")
+			Info("Zapisywanie pliku '%s'..." % filename, False)
 		else:
+			try:
+				Info("Wczytywanie pliku '%s' (%d/%d)..." % (filename, file_num+1, len(FileList)), False)
+				if not fileok(filename):
+					continue
+
+				File = SpellerEditor(open(filename, 'r'), re_whitespaces, 'W', re_punctuators, 'P', corrector.editor.regexp_mark, 'check', filter)
+				Info("ok, wczytano %d linii (%s)" % (len(File), getsize(filename)))
+
+			except KeyboardInterrupt:
+				if QuestionYesNo('Przerwa przetwarzanie plikw', False, False):
+					Die("Przerwany")
+			except IOError:
+				e = sys.exc_info()
+				Info('%s: %s' % (str(e[0]), str(e[1])))
+
+			try:
+				Terminal.settitle("Sprawdzanie pliku '%s'" % filename)
+				CheckFile()
+			except (AbortProgram, KeyboardInterrupt):
+				if QuestionYesNo('Zakoczy program', False, False):
+					Die("Przerwane")
+				continue
+
 			Info("Zapisywanie pliku '%s'..." % filename, False)
 			tmpname = tmpfilename('.', filename+'-')
 			try:
@@ -1725,60 +4254,69 @@ if __name__ == "__main__":
 				e = sys.exc_info()
 				Die('%s: %s' % (str(e[0]), str(e[1])))
 
+		try:
+			ReplaceFile(filename, tmpname)
+		except (OSError, KeyboardInterrupt):
+			e = sys.exc_info()
+			Info('%s: %s' % (str(e[0]), str(e[1])))
+			Info("Zmieniony tekst zosta zachowany w pliku '%s'." % tmpname)
+			continue
+
+		Info("ok", flush=True)
+	
+	if pool:
+		pool.close()
+		pool.join()
+
+	# caches of client are kept by server, other backends have none
+	if not options['connect'] and options['backend'] == 'aspell':
+		path = options['cache_path'] + os.sep + options['cache_dictionary']
+		Info("Zapisywanie sownika do '%s'..." % path, False)
+		try:
+			speller.save_dict()
+		except:
+			e = sys.exc_info()
+			Info('%s: %s' % (str(e[0]), str(e[1])))
+		else:
+			Info("ok", flush=True)
+	
+		path = options['cache_path'] + os.sep + options['cache_suggestions']
+		Info("Zapisywanie podpowiedzi do '%s'..." % path, False)
+		try:
+			speller.save_sugg()
+		except:
+			e = sys.exc_info()
+			Info('%s: %s' % (str(e[0]), str(e[1])))
+		else:
+			Info("ok", flush=True)
+		
+		if not options['wordlist']:	# see PolishSpeller
+			path = options['cache_path'] + os.sep + options['cache_pl_suggestions']
+			Info("Zapisywanie polskich podpowiedzi do '%s'..." % path, False)
 			try:
-				if os.path.exists(filename+'~'):
-					os.unlink(filename+'~')
-				os.rename(filename, filename+'~')
-			except KeyboardInterrupt:
-				e = sys.exc_info()
-				Info('%s: %s' % (str(e[0]), str(e[1])))
-				Info("Zmieniony tekst zosta zachowany w pliku '%s'." % tmpname)
-				continue
-			
-			try:
-				os.rename(tmpname, filename)
-			except OSError:
-				os.rename(filename+'~', filename)
+				pl_speller.save_sugg()
+			except:
 				e = sys.exc_info()
 				Info('%s: %s' % (str(e[0]), str(e[1])))
-				Info("Zmieniony tekst zosta zachowany w pliku '%s'." % tmpname)
+			else:
+				Info("ok", flush=True)
 
+	if options['memorize']:
+		path = options['cache_path'] + os.sep + options['cache_replace']
+		Info("Zapisywanie zamienianych i ignorowanych sw do '%s'..." % path, False)
+		try:
+			replace_list.save()
+			ignore_list.save()
+		except:
+			e = sys.exc_info()
+			Info('%s: %s' % (str(e[0]), str(e[1])))
+		else:
 			Info("ok", flush=True)
-	
-	path = options['cache_path'] + os.sep + options['cache_dictionary']
-	Info("Zapisywanie sownika do '%s'..." % path, False)
-	try:
-		tmpname = tmpfilename('.', 'tmp-')
-		speller.save_dict(tmpname)
-	except:
-		e = sys.exc_info()
-		Info('%s: %s' % (str(e[0]), str(e[1])))
-	else:
-		os.rename(tmpname, path)
-		Info("ok", flush=True)
-	
-	path = options['cache_path'] + os.sep + options['cache_suggestions']
-	Info("Zapisywanie podpowiedzi do '%s'..." % path, False)
-	try:
-		tmpname = tmpfilename('.', 'tmp-')
-		speller.save_sugg(tmpname)
-	except:
-		e = sys.exc_info()
-		Info('%s: %s' % (str(e[0]), str(e[1])))
-	else:
-		os.rename(tmpname, path)
-		Info("ok", flush=True)
-		
-	path = options['cache_path'] + os.sep + options['cache_pl_suggestions']
-	Info("Zapisywanie polskich podpowiedzi do '%s'..." % path, False)
-	try:
-		tmpname = tmpfilename('.', 'tmp-')
-		pl_speller.save_sugg(tmpname)
-	except:
-		e = sys.exc_info()
-		Info('%s: %s' % (str(e[0]), str(e[1])))
-	else:
-		os.rename(tmpname, path)
-		Info("ok", flush=True)
+
+	for name, cache in [('sownik', speller.dict), ('podpowiedzi', speller.sugg), ('polskie podpowiedzi', pl_speller.sugg)]:
+		stats = cache.stats()
+		if stats['hits'] or stats['misses']:
+			Info("Pami podrczna (%s): trafienia %d, chybienia %d, usunite %d" % \
+			     (name, stats['hits'], stats['misses'], stats['evictions']))
 
 # vim: ts=4 shiftwidth=4 nowrap